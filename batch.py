@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from create_menu import Menu, parse_args, validate_args
+from tandoor_api import TandoorAPI
+from utils import init_worker_logging, log_queue, setup_logging
+
+
+class Profile:
+    '''
+    one household's config and everything produced for it; an error only fails its own profile
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.name = os.path.splitext(os.path.basename(config))[0]
+        self.args = None
+        self.menu = None
+        self.recipes = []
+        self.error = None
+
+    def fail(self, stage, error, logger):
+        self.error = f'{stage}: {error}'
+        logger.warning(f'Profile {self.name} failed to {stage}: {error}')
+
+
+class BatchRunner:
+    '''
+    runs many configs in one process: their API calls are merged into one deduplicated fetch over
+    a shared connection pool, menus share recipe pools and hierarchies, and solves run in a process pool
+    '''
+
+    def __init__(self, configs, logger, workers=None, fetch_workers=8):
+        self.profiles = [Profile(c) for c in configs]
+        self.logger = logger
+        self.workers = workers
+        self.fetch_workers = fetch_workers
+        self.apis = {}
+        self.pools = {}
+        self.hierarchies = {}
+
+    def active(self):
+        return [p for p in self.profiles if p.error is None]
+
+    def api_key(self, args):
+        # profiles only share an API, and its cache and limits, when they agree on all of them
+        return json.dumps([args.url, args.token, args.cache, args.cache_policy, args.cache_backend, args.retries, args.rate_limit, args.rate_burst], sort_keys=True, default=str)
+
+    def get_api(self, args):
+        key = self.api_key(args)
+        if key not in self.apis:
+            self.apis[key] = TandoorAPI(
+                args.url, args.token, self.logger, cache=int(args.cache), progress=False, cache_policy=args.cache_policy, cache_backend=args.cache_backend,
+                retries=args.retries, rate_limit=args.rate_limit, rate_burst=args.rate_burst
+            )
+        return self.apis[key]
+
+    def load(self):
+        for profile in self.profiles:
+            try:
+                profile.args = parse_args(['-c', profile.config])
+                validate_args(profile.args)
+                profile.menu = Menu(profile.args, tandoor=self.get_api(profile.args), logger=self.logger)
+            except SystemExit:
+                # argparse already printed what is wrong
+                profile.fail('load the config', 'invalid options', self.logger)
+            except Exception as e:
+                profile.fail('load the config', e, self.logger)
+
+    def prefetch(self):
+        '''
+        makes the API calls of every profile once, several at a time; the menus then read them from the cache
+        '''
+        first, second = {}, []
+        for profile in self.active():
+            if int(profile.args.cache) <= 0 or profile.menu.snapshot:
+                continue
+            calls, book_contents = profile.menu.fetch_plan()
+            key = self.api_key(profile.args)
+            for description, func in calls:
+                first.setdefault((key, description), func)
+            second.append((key, book_contents))
+
+        results = {}
+
+        def _run(calls):
+            with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+                futures = {call: executor.submit(func) for call, func in calls.items()}
+                for call, future in futures.items():
+                    try:
+                        results[call] = future.result()
+                    except Exception as e:
+                        # the profile that needs it will run into the error itself
+                        self.logger.debug(f'Unable to prefetch {call[1]}: {e}')
+
+        start = time.perf_counter()
+        _run(first)
+        phase = {}
+        for key, book_contents in second:
+            server_results = {description: result for (k, description), result in results.items() if k == key}
+            for description, func in book_contents(server_results):
+                phase.setdefault((key, description), func)
+        _run(phase)
+        # the results are in the cache now, the menus read them from there
+        for api in self.apis.values():
+            api.reset_memo()
+        self.logger.info(f'Prefetched {len(results)} API calls for {len(self.active())} profiles in {time.perf_counter() - start:.1f} seconds.')
+
+    def prepare(self):
+        for profile in self.active():
+            args, menu = profile.args, profile.menu
+            key = json.dumps([args.snapshot, args.url, args.recipes, args.filters, args.plan_type, args.mp_date.strftime('%Y-%m-%d'), [d and d.strftime('%Y-%m-%d') for d in (args.plan_from, args.plan_to)], menu.pushdown_params()], sort_keys=True, default=str)
+            menu.recipe_pool = self.pools.get(key)
+            hierarchies = self.hierarchies.setdefault((args.url, args.token, args.snapshot), {})
+            menu._keywords, menu._foods = hierarchies.get('keywords'), hierarchies.get('foods')
+            try:
+                menu.prepare_data()
+            except Exception as e:
+                profile.fail('prepare data', e, self.logger)
+                continue
+            self.pools.setdefault(key, list(menu.recipes))
+            hierarchies['keywords'], hierarchies['foods'] = menu._keywords, menu._foods
+            if len(menu.recipes) < menu.choices:
+                profile.fail('choose recipes', f'only {len(menu.recipes)} recipes to work with', self.logger)
+
+    def solve(self):
+        profiles = self.active()
+        from solver import solve_specs
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker_logging, initargs=(log_queue(), self.logger.level)) as executor:
+            futures = [
+                executor.submit(solve_specs, p.menu.recipes, p.menu.choices, p.menu.constraint_specs(), self.logger.loglevel, p.args.sample_pool)
+                for p in profiles
+            ]
+            for profile, future in zip(profiles, futures):
+                try:
+                    selected = set(future.result())
+                    profile.recipes = [r for r in profile.menu.recipes if r.id in selected]
+                except Exception as e:
+                    profile.fail('choose recipes', e, self.logger)
+
+    def finish(self):
+        output_names = set()
+        for idx, profile in enumerate(self.active()):
+            try:
+                if profile.args.create_mp:
+                    profile.menu.create_meal_plans(profile.recipes)
+                if profile.args.create_file:
+                    # profiles usually share the template and output_dir, so each writes its own files
+                    name = f"{profile.args.file_template.split('.')[0]}-{profile.name}"
+                    if os.path.join(profile.args.output_dir or '', name) in output_names:
+                        name = f'{name}_{idx}'
+                    output_names.add(os.path.join(profile.args.output_dir or '', name))
+                    profile.args.output_name = name
+                    profile.menu.generate_menu_file(profile.recipes)
+            except Exception as e:
+                profile.fail('create the meal plan or menu file', e, self.logger)
+
+    def run(self):
+        self.load()
+        self.prefetch()
+        self.prepare()
+        if self.active():
+            self.solve()
+        self.finish()
+        return self.profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create menus for many config files, sharing one fetch of the Tandoor library.')
+    parser.add_argument('configs', nargs='+', help='Config files, one per household.')
+    parser.add_argument('--workers', type=int, help='Processes to solve in; defaults to the number of CPUs.')
+    parser.add_argument('--fetch_workers', type=int, default=8, help='Concurrent requests to Tandoor.')
+    parser.add_argument('--log', default='info', help='Sets the logging level')
+    parser.add_argument('--log_file_level', default='debug', help='Sets the logging level of cocktail-menu.log')
+    args = parser.parse_args()
+
+    logger = setup_logging(log=args.log, file_level=args.log_file_level)
+    profiles = BatchRunner(args.configs, logger, workers=args.workers, fetch_workers=args.fetch_workers).run()
+    for profile in profiles:
+        print(f'\n###########################\n{profile.name}:')
+        if profile.error:
+            print(f'Failed to {profile.error}')
+            continue
+        for r in profile.recipes:
+            print(f'Recipe: <{r.id}> {r.name}: {profile.menu.tandoor.url.replace("/api/","/view/recipe/")}{r.id}')
+    print('###########################\n')
+    failed = [p.name for p in profiles if p.error]
+    if failed:
+        logger.warning(f'{len(failed)} of {len(profiles)} profiles failed: {", ".join(failed)}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.request import urlopen
+
+from benchmarks.fake_tandoor import run_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ['prepare_recipes', 'prepare_keywords', 'prepare_foods', 'prepare_books', 'select_recipes', 'create_meal_plans', 'generate_menu_file']
+
+DEFAULT_CONFIG = '''[create-menu]
+cache: 240
+
+[conditions]
+choices: 5
+keyword: [{{"condition": [1, 2], "count": 1, "operator": ">="}}]
+food: [{{"condition": 3, "count": 1, "operator": ">=", "except": [4]}}]
+book: [{{"condition": [1, 2], "count": 1, "operator": "<="}}]
+rating: [{{"condition": 3, "count": 2, "operator": ">="}}]
+cookedon: [{{"condition": "30days", "count": 0, "operator": "=="}}]
+
+[mealplan]
+create_mp: true
+mp_type: 1
+cleanup_mp: true
+
+[menufile]
+create_file: {render}
+file_template: benchmark.svg
+replace_text: {replace_text}
+'''
+
+
+def _replace_text(slots=5):
+    return {
+        'date_text': {'date': 'DATE PLACEHOLDER TEXT', 'format': 'short'},
+        'recipe_text': [
+            {'name': f'Recipe {i} name placeholder text here', 'ingredients': [f'Recipe {i} ingredient line {n} placeholder text here' for n in range(1, 3)]}
+            for i in range(1, slots + 1)
+        ]
+    }
+
+
+def _template(replace_text):
+    lines = [replace_text['date_text']['date']]
+    for slot in replace_text['recipe_text']:
+        lines += [slot['name']] + slot['ingredients']
+    text = ''.join(f'<text x="20" y="{30 + 20 * i}" font-size="12">{t}</text>' for i, t in enumerate(lines))
+    return f'<svg xmlns="http://www.w3.org/2000/svg" width="600" height="{60 + 20 * len(lines)}">{text}</svg>'
+
+
+def _server_stats(url):
+    with urlopen(f'{url}/__stats__') as response:
+        return json.loads(response.read())
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, linux kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_stages(url, config, result_file):
+    from create_menu import Menu, parse_args, validate_args
+    from tandoor_api import TandoorAPI
+    from utils import setup_logging
+
+    started = time.perf_counter()
+    args = parse_args(['-c', config, '--url', url, '--token', 'benchmark', '--log', 'warning'])
+    validate_args(args)
+    logger = setup_logging(log=args.log)
+    menu = Menu(args, tandoor=TandoorAPI(args.url, args.token, logger, cache=int(args.cache), progress=False), logger=logger)
+    stages = []
+
+    def timed(name, func):
+        def wrapper(*a, **kw):
+            before = _server_stats(url)
+            start = time.perf_counter()
+            try:
+                return func(*a, **kw)
+            finally:
+                wall = time.perf_counter() - start
+                after = _server_stats(url)
+                requests = {k: v - before['requests'].get(k, 0) for k, v in after['requests'].items() if v != before['requests'].get(k, 0)}
+                stages.append({
+                    'name': name,
+                    'wall': round(wall, 6),
+                    'requests': after['total'] - before['total'],
+                    'bytes': after['bytes'] - before['bytes'],
+                    'requests_by_endpoint': requests,
+                    'peak_rss_kb': _peak_rss_kb()
+                })
+        return wrapper
+
+    for name in STAGES:
+        setattr(menu, name, timed(name, getattr(menu, name)))
+
+    setup = time.perf_counter() - started
+    menu.prepare_data()
+    recipes = menu.select_recipes()
+    if args.create_mp:
+        menu.create_meal_plans(recipes)
+    if args.create_file:
+        menu.generate_menu_file(recipes)
+
+    with open(result_file, 'w') as f:
+        json.dump({
+            'setup': round(setup, 6),
+            'total': round(time.perf_counter() - started, 6),
+            'pool_size': len(menu.recipes),
+            'selected': [r.id for r in recipes],
+            'peak_rss_kb': _peak_rss_kb(),
+            'stages': stages
+        }, f)
+
+
+def _git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    print(f'\nCompared with {baseline.get("version")}:')
+    for new_pass, old_pass in zip(report['passes'], baseline['passes']):
+        old_stages = {s['name']: s for s in old_pass['stages']}
+        for stage in new_pass['stages']:
+            if not (old := old_stages.get(stage['name'])):
+                continue
+            change = (stage['wall'] - old['wall']) / old['wall'] * 100 if old['wall'] else 0
+            print(f'{new_pass["name"]:>5} {stage["name"]:<20} {old["wall"] * 1000:>9.1f} -> {stage["wall"] * 1000:>9.1f} ms ({change:+.0f}%)  requests {old["requests"]} -> {stage["requests"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of create_menu against a local fake Tandoor server.')
+    parser.add_argument('--recipes', type=int, default=1000, help='Recipes in the synthetic library (1k - 100k).')
+    parser.add_argument('--keywords', type=int, default=200)
+    parser.add_argument('--foods', type=int, default=500)
+    parser.add_argument('--books', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of latency injected into every request.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--passes', type=int, default=2, help='The first pass runs with a cold cache, later passes reuse it.')
+    parser.add_argument('--config', help='Config file with the constraints to benchmark; url and token are replaced.')
+    parser.add_argument('--render', action='store_true', default=False, help='Include menu file generation (requires pdf_requirements.txt).')
+    parser.add_argument('--output', default='bench_report.json', help='Where to write the JSON report.')
+    parser.add_argument('--compare', help='Previous report to compare against.')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_stages(args.url, args.config, args.result)
+        return
+
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_server, kwargs={
+        'port_queue': ports, 'latency': args.latency, 'recipes': args.recipes,
+        'keywords': args.keywords, 'foods': args.foods, 'books': args.books, 'seed': args.seed
+    }, daemon=True)
+    server.start()
+    url = f'http://127.0.0.1:{ports.get(timeout=600)}'
+
+    workdir = tempfile.mkdtemp(prefix='menu-bench-')
+    try:
+        config = os.path.abspath(args.config) if args.config else os.path.join(workdir, 'config.ini')
+        if not args.config:
+            replace_text = _replace_text()
+            with open(config, 'w') as f:
+                f.write(DEFAULT_CONFIG.format(render=str(args.render).lower(), replace_text=json.dumps(replace_text)))
+            os.makedirs(os.path.join(workdir, 'templates'))
+            with open(os.path.join(workdir, 'templates', 'benchmark.svg'), 'w') as f:
+                f.write(_template(replace_text))
+
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+        passes = []
+        for idx in range(args.passes):
+            result_file = os.path.join(workdir, f'pass-{idx}.json')
+            subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_e2e', '--worker', '--url', url, '--config', config, '--result', result_file],
+                cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL
+            )
+            with open(result_file) as f:
+                result = json.load(f)
+            result['name'] = 'cold' if idx == 0 else 'warm'
+            passes.append(result)
+    finally:
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'version': _git_version(),
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'settings': {k: getattr(args, k) for k in ('recipes', 'keywords', 'foods', 'books', 'latency', 'seed', 'passes', 'config', 'render')},
+        'passes': passes
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for p in passes:
+        print(f'\n{p["name"]} pass: {p["total"] * 1000:.1f} ms total, pool of {p["pool_size"]} recipes, peak RSS {p["peak_rss_kb"] / 1024:.1f} MB')
+        for stage in p['stages']:
+            print(f'  {stage["name"]:<20} {stage["wall"] * 1000:>9.1f} ms {stage["requests"]:>6} requests')
+    print(f'\nReport written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
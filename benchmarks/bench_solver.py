@@ -0,0 +1,169 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from models import Recipe
+from solver import RecipePicker
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'solver_baseline.json')
+
+# (pool size, constraints, overlap, tightness)
+GRID = {
+    'pool': [1000, 5000, 20000],
+    'constraints': [2, 8, 16],
+    'overlap': [0.0, 0.5],
+    'tightness': ['loose', 'tight'],
+}
+QUICK_GRID = {
+    'pool': [1000, 5000],
+    'constraints': [2, 8],
+    'overlap': [0.5],
+    'tightness': ['loose', 'tight'],
+}
+# fraction of the pool matching each constraint
+DENSITY = {'loose': 0.2, 'tight': 0.01}
+
+
+def make_pool(size, rnd):
+    now = datetime.now().astimezone()
+    pool = []
+    for rid in range(1, size + 1):
+        pool.append(Recipe({
+            'id': rid, 'name': f'Recipe {rid}', 'description': '', 'new': False, 'servings': 4, 'keywords': [],
+            'last_cooked': None, 'created_at': (now - timedelta(days=rnd.randint(0, 1000))).isoformat(), 'rating': rnd.randint(0, 5)
+        }))
+    return pool
+
+
+def make_constraints(pool, count, overlap, tightness, choices, rnd):
+    '''
+    each constraint matches DENSITY of the pool; overlap is the share of matches drawn from a core
+    that every constraint has in common, so constraints compete for the same recipes as it grows
+    '''
+    matches = max(1, int(len(pool) * DENSITY[tightness]))
+    core = rnd.sample(pool, matches)
+    constraints = []
+    for idx in range(count):
+        shared = int(matches * overlap)
+        found = rnd.sample(core, shared) + rnd.sample(pool, matches - shared)
+        operator = ['>=', '<=', '=='][idx % 3]
+        numrecipes = {'>=': 1, '<=': choices - 1, '==': 1}[operator]
+        constraints.append((found, numrecipes, operator, idx % 4 == 3))
+    return constraints
+
+
+def run_case(pool_size, constraints, overlap, tightness, choices, repeats, seed):
+    logger = logging.getLogger('SolverBenchmark')
+    logger.setLevel(logging.ERROR)
+    logger.loglevel = logging.ERROR
+    rnd = random.Random(seed)
+    pool = make_pool(pool_size, rnd)
+    constraint_set = make_constraints(pool, constraints, overlap, tightness, choices, rnd)
+
+    def _build():
+        picker = RecipePicker(pool, choices, logger=logger)
+        for found, numrecipes, operator, exclude in constraint_set:
+            picker.add_keyword_constraint(found, numrecipes, operator, exclude=exclude)
+        return picker
+
+    # memory is traced in a separate build, tracing would distort the timings
+    tracemalloc.start()
+    _build()
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    build, solve = [], []
+    feasible = True
+    for r in range(repeats):
+        random.seed(seed + r)
+        start = time.perf_counter()
+        picker = _build()
+        build.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        try:
+            picker.solve()
+        except RuntimeError:
+            feasible = False
+        solve.append(time.perf_counter() - start)
+
+    return {
+        'build': statistics.median(build),
+        'solve': statistics.median(solve),
+        'memory_kb': memory // 1024,
+        # CBC runs as a child process, this is the largest one seen so far
+        'solver_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // (1024 if sys.platform == 'darwin' else 1),
+        'feasible': feasible,
+    }
+
+
+def check_regressions(results, baseline, threshold, slack):
+    regressions = []
+    for name, result in results.items():
+        if not (old := baseline.get('cases', {}).get(name)):
+            continue
+        for metric in ('build', 'solve'):
+            limit = old[metric] * (1 + threshold) + slack
+            if result[metric] > limit:
+                regressions.append(f'{name} {metric}: {old[metric] * 1000:.1f} ms -> {result[metric] * 1000:.1f} ms (limit {limit * 1000:.1f} ms)')
+        if result['memory_kb'] > old['memory_kb'] * (1 + threshold) + 1024:
+            regressions.append(f'{name} memory: {old["memory_kb"]} KB -> {result["memory_kb"]} KB')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Model build and solve benchmarks for RecipePicker.')
+    parser.add_argument('--quick', action='store_true', help='Run a smaller grid.')
+    parser.add_argument('--choices', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=3, help='Each case is run this many times, the median is reported.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline results to compare against.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline.')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed relative slowdown before a case fails.')
+    parser.add_argument('--slack', type=float, default=0.005, help='Seconds of absolute slack to absorb noise in fast cases.')
+    parser.add_argument('--output', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    grid = QUICK_GRID if args.quick else GRID
+    results = {}
+    for pool_size, constraints, overlap, tightness in itertools.product(grid['pool'], grid['constraints'], grid['overlap'], grid['tightness']):
+        name = f'pool={pool_size} constraints={constraints} overlap={overlap} {tightness}'
+        results[name] = run_case(pool_size, constraints, overlap, tightness, args.choices, args.repeats, args.seed)
+        r = results[name]
+        print(f'{name:<50} build {r["build"] * 1000:>8.1f} ms  solve {r["solve"] * 1000:>8.1f} ms  {r["memory_kb"]:>7} KB{"" if r["feasible"] else "  infeasible"}')
+
+    report = {'created': datetime.now().isoformat(), 'choices': args.choices, 'repeats': args.repeats, 'seed': args.seed, 'cases': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --save-baseline to create one.')
+        return 0
+    with open(args.baseline) as f:
+        regressions = check_regressions(results, json.load(f), args.threshold, args.slack)
+    if regressions:
+        print(f'\n{len(regressions)} regressions beyond {args.threshold:.0%}:')
+        for r in regressions:
+            print(f'  {r}')
+        return 1
+    print(f'\nNo regressions beyond {args.threshold:.0%} of the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
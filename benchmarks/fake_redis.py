@@ -0,0 +1,112 @@
+import argparse
+import socketserver
+import threading
+import time
+from collections import Counter
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    '''
+    speaks enough RESP for cache_backends.RedisBackend: PING, AUTH, SELECT, GET, SET [EX|PX], DEL, DBSIZE, FLUSHDB
+    '''
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # inline command, e.g. from telnet
+            return line.split()
+        parts = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            parts.append(self.rfile.read(length + 2)[:-2])
+        return parts
+
+    def _reply(self, value):
+        if value is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(value, int):
+            self.wfile.write(b':%d\r\n' % value)
+        elif isinstance(value, Exception):
+            self.wfile.write(b'-ERR %s\r\n' % str(value).encode('utf-8'))
+        elif value == 'OK' or value == 'PONG':
+            self.wfile.write(b'+%s\r\n' % value.encode('utf-8'))
+        else:
+            self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+
+    def handle(self):
+        server = self.server
+        db = 0
+        authed = server.password is None
+        while (parts := self._read_command()) is not None:
+            if not parts:
+                continue
+            command, args = parts[0].upper(), parts[1:]
+            server.stats[command.decode('utf-8', 'replace')] += 1
+            if command == b'AUTH':
+                authed = args[-1].decode('utf-8') == server.password
+                self._reply('OK' if authed else ValueError('invalid password'))
+                continue
+            if not authed:
+                self._reply(ValueError('NOAUTH Authentication required.'))
+                continue
+            with server.lock:
+                data = server.dbs.setdefault(db, {})
+                if command == b'PING':
+                    self._reply('PONG')
+                elif command == b'SELECT':
+                    db = int(args[0])
+                    self._reply('OK')
+                elif command == b'GET':
+                    value, expires = data.get(args[0], (None, None))
+                    if expires is not None and expires < time.time():
+                        data.pop(args[0], None)
+                        value = None
+                    self._reply(value)
+                elif command == b'SET':
+                    expires = None
+                    options = [a.upper() for a in args[2:]]
+                    if b'EX' in options:
+                        expires = time.time() + int(args[2 + options.index(b'EX') + 1])
+                    elif b'PX' in options:
+                        expires = time.time() + int(args[2 + options.index(b'PX') + 1]) / 1000
+                    data[args[0]] = (args[1], expires)
+                    self._reply('OK')
+                elif command == b'DEL':
+                    self._reply(sum(data.pop(k, None) is not None for k in args))
+                elif command == b'DBSIZE':
+                    self._reply(len(data))
+                elif command == b'FLUSHDB':
+                    data.clear()
+                    self._reply('OK')
+                else:
+                    self._reply(ValueError(f"unknown command '{command.decode('utf-8', 'replace')}'"))
+            self.wfile.flush()
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, password=None):
+        super().__init__(address, FakeRedisHandler)
+        self.password = password
+        self.dbs = {}
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A small in-memory stand-in for a Redis server, to try the shared cache backend.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--password')
+    args = parser.parse_args()
+    server = FakeRedisServer((args.host, args.port), password=args.password)
+    print(f'Serving RESP on {args.host}:{server.server_address[1]}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
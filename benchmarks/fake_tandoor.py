@@ -0,0 +1,323 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+WORDS = [
+    'chicken', 'beef', 'pork', 'tofu', 'salmon', 'shrimp', 'lentil', 'bean', 'rice', 'noodle',
+    'potato', 'tomato', 'onion', 'garlic', 'pepper', 'spinach', 'mushroom', 'cheese', 'lemon', 'basil',
+    'curry', 'stew', 'salad', 'soup', 'roast', 'grilled', 'baked', 'spicy', 'smoky', 'creamy'
+]
+
+
+class FakeLibrary:
+    '''
+    a synthetic Tandoor space: recipes, keyword and food trees, books, meal plans and substitutes
+    everything is generated from the seed so two servers with the same settings serve the same data
+    '''
+
+    def __init__(self, recipes=1000, keywords=200, foods=500, books=20, seed=1):
+        rnd = random.Random(seed)
+        self.now = datetime.now().astimezone()
+        self.keywords = self._tree('keyword', keywords, rnd)
+        self.foods = self._tree('food', foods, rnd)
+        for f in self.foods.values():
+            f.update({
+                'shopping': '', 'recipe': None, 'food_onhand': rnd.random() < 0.6,
+                'ignore_shopping': False, 'substitute_onhand': False
+            })
+        self.keyword_children = self._children(self.keywords)
+        self.food_children = self._children(self.foods)
+
+        self.recipes = {}
+        self.recipe_foods = {}
+        keyword_ids = list(self.keywords)
+        food_ids = list(self.foods)
+        for rid in range(1, recipes + 1):
+            created = self.now - timedelta(days=rnd.randint(0, 1500))
+            cooked = self.now - timedelta(days=rnd.randint(0, 365)) if rnd.random() < 0.7 else None
+            self.recipes[rid] = {
+                'id': rid,
+                'name': ' '.join(rnd.sample(WORDS, rnd.randint(2, 4))).title(),
+                'description': '',
+                'new': False,
+                'servings': rnd.randint(1, 8),
+                'keywords': [{'id': k, 'name': self.keywords[k]['name'], 'label': self.keywords[k]['name']} for k in rnd.sample(keyword_ids, min(len(keyword_ids), rnd.randint(1, 6)))],
+                'last_cooked': cooked.isoformat() if cooked else None,
+                'created_at': created.isoformat(),
+                'updated_at': created.isoformat(),
+                'rating': rnd.choice([0, 1, 2, 3, 3.5, 4, 4.5, 5]),
+            }
+            self.recipe_foods[rid] = rnd.sample(food_ids, min(len(food_ids), rnd.randint(4, 12)))
+
+        recipe_ids = list(self.recipes)
+        self.books = {}
+        for bid in range(1, books + 1):
+            self.books[bid] = {
+                'id': bid,
+                'name': f'Book {bid}',
+                'filter': {'id': bid} if bid % 5 == 0 else None,
+                'recipes': rnd.sample(recipe_ids, min(len(recipe_ids), rnd.randint(10, 60)))
+            }
+        self.meal_types = {mt: {'id': mt, 'name': f'Meal Type {mt}'} for mt in range(1, 4)}
+        self.meal_plans = {}
+        for pid in range(1, max(1, recipes // 50) + 1):
+            day = (self.now + timedelta(days=rnd.randint(-14, 14))).strftime('%Y-%m-%d')
+            self._add_plan(pid, rnd.choice(recipe_ids), day, rnd.choice(list(self.meal_types)))
+        self.plan_lock = threading.Lock()
+        self.substitutes = {f: rnd.sample(food_ids, 2) for f in food_ids if rnd.random() < 0.3}
+
+    @staticmethod
+    def _tree(kind, count, rnd):
+        nodes = {}
+        for node_id in range(1, count + 1):
+            parent = rnd.randint(1, node_id - 1) if node_id > max(1, count // 10) else None
+            nodes[node_id] = {'id': node_id, 'name': f'{kind} {node_id}', 'label': f'{kind} {node_id}', 'description': '', 'parent': parent, 'numchild': 0}
+            if parent:
+                nodes[parent]['numchild'] += 1
+        return nodes
+
+    @staticmethod
+    def _children(nodes):
+        children = {}
+        for n in nodes.values():
+            if n['parent']:
+                children.setdefault(n['parent'], []).append(n['id'])
+        return children
+
+    @staticmethod
+    def descendants(children, node_id):
+        result = [node_id]
+        idx = 0
+        while idx < len(result):
+            result += children.get(result[idx], [])
+            idx += 1
+        return result
+
+    def _add_plan(self, pid, rid, day, meal_type):
+        recipe = self.recipes[rid]
+        self.meal_plans[pid] = {
+            'id': pid, 'title': recipe['name'], 'recipe': recipe, 'servings': recipe['servings'],
+            'note': '', 'from_date': day, 'to_date': day, 'meal_type': self.meal_types[meal_type], 'shared': []
+        }
+
+    def search_recipes(self, params):
+        children = params.get('include_children', ['True'])[0].lower() in ('true', '1')
+        recipes = list(self.recipes.values())
+
+        def _ids(name):
+            return [int(x) for x in params.get(name, []) if str(x).lstrip('-').isdigit()]
+
+        def _expand(tree, ids):
+            if not children:
+                return set(ids)
+            return {d for i in ids for d in self.descendants(tree, i)}
+
+        if keywords := _ids('keywords_or'):
+            wanted = _expand(self.keyword_children, keywords)
+            recipes = [r for r in recipes if any(k['id'] in wanted for k in r['keywords'])]
+        if keywords := _ids('keywords_or_not'):
+            unwanted = _expand(self.keyword_children, keywords)
+            recipes = [r for r in recipes if not any(k['id'] in unwanted for k in r['keywords'])]
+        if foods := _ids('foods_or'):
+            wanted = _expand(self.food_children, foods)
+            recipes = [r for r in recipes if any(f in wanted for f in self.recipe_foods[r['id']])]
+        if foods := _ids('foods_or_not'):
+            unwanted = _expand(self.food_children, foods)
+            recipes = [r for r in recipes if not any(f in unwanted for f in self.recipe_foods[r['id']])]
+        if rating := params.get('rating', [None])[0]:
+            rating = float(rating)
+            if rating < 0:
+                recipes = [r for r in recipes if r['rating'] and r['rating'] < abs(rating)]
+            else:
+                recipes = [r for r in recipes if (r['rating'] or 0) >= rating]
+        for field, param in (('last_cooked', 'cookedon'), ('created_at', 'createdon')):
+            if value := params.get(param, [None])[0]:
+                before = value.startswith('-')
+                day = value.lstrip('-')[:10]
+                recipes = [r for r in recipes if r[field] and ((r[field][:10] <= day) if before else (r[field][:10] >= day))]
+        if custom_filter := params.get('filter', [None])[0]:
+            recipes = [r for r in recipes if r['id'] % (int(custom_filter) + 1) == 0]
+        if query := params.get('query', [None])[0]:
+            recipes = [r for r in recipes if query.lower() in r['name'].lower()]
+        return recipes
+
+    def recipe_details(self, rid):
+        recipe = dict(self.recipes[rid])
+        recipe['steps'] = [{'ingredients': [{'food': self.foods[f]} for f in self.recipe_foods[rid]]}]
+        return recipe
+
+
+class FakeTandoorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None):
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.stats['bytes'] += len(data)
+
+    def _paged(self, items, path, params):
+        page = int(params.get('page', ['1'])[0])
+        page_size = int(params.get('page_size', ['100'])[0])
+        start = (page - 1) * page_size
+        nxt = None
+        if start + page_size < len(items):
+            query = {k: v for k, v in params.items()}
+            query['page'] = [str(page + 1)]
+            nxt = f'http://{self.headers["Host"]}{path}?{urlencode(query, doseq=True)}'
+        return {'count': len(items), 'next': nxt, 'previous': None, 'results': items[start:start + page_size]}
+
+    def _count(self, path):
+        endpoint = re.sub(r'/\d+', '/{id}', path.split('/api/', 1)[-1])
+        self.server.stats['requests'][f'{self.command} {endpoint}'] += 1
+        self.server.stats['total'] += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def _throttled(self):
+        '''
+        answers a share of the requests with 429 or 503, like a busy server or proxy
+        '''
+        if not self.server.error_rate or self.server.random.random() >= self.server.error_rate:
+            return False
+        self.server.stats['errors'] += 1
+        data = b'{"detail": "Request was throttled."}'
+        self.send_response(429 if self.server.random.random() < 0.5 else 503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        params = parse_qs(url.query)
+        lib = self.server.library
+        if path == '/__stats__':
+            return self._send(200, {
+                'requests': dict(self.server.stats['requests']), 'total': self.server.stats['total'],
+                'bytes': self.server.stats['bytes'], 'errors': self.server.stats['errors']
+            })
+        self._count(path)
+        if self._throttled():
+            return
+        parts = [p for p in path.split('/api/', 1)[-1].split('/') if p]
+        try:
+            if parts == ['recipe']:
+                return self._send(200, self._paged(lib.search_recipes(params), path, params))
+            if parts[0] == 'recipe' and len(parts) == 2:
+                return self._send(200, lib.recipe_details(int(parts[1])))
+            if parts[0] in ('keyword', 'food') and len(parts) == 1:
+                nodes, children = (lib.keywords, lib.keyword_children) if parts[0] == 'keyword' else (lib.foods, lib.food_children)
+                if tree := params.get('tree', [None])[0]:
+                    items = [nodes[i] for i in lib.descendants(children, int(tree))]
+                else:
+                    items = list(nodes.values())
+                return self._send(200, self._paged(items, path, params))
+            if parts[0] == 'food' and len(parts) == 3 and parts[2] == 'substitutes':
+                return self._send(200, [lib.foods[f] for f in lib.substitutes.get(int(parts[1]), []) if lib.foods[f]['food_onhand']])
+            if parts[0] == 'food' and len(parts) == 2:
+                return self._send(200, lib.foods[int(parts[1])])
+            if parts[0] == 'recipe-book' and len(parts) == 2:
+                book = dict(lib.books[int(parts[1])])
+                book.pop('recipes')
+                return self._send(200, book)
+            if parts == ['recipe-book-entry']:
+                book = lib.books[int(params['book'][0])]
+                return self._send(200, [{'book': book['id'], 'recipe': r, 'recipe_content': lib.recipes[r]} for r in book['recipes']])
+            if parts[0] == 'meal-type' and len(parts) == 2:
+                return self._send(200, lib.meal_types[int(parts[1])])
+            if parts == ['meal-plan']:
+                start = params.get('from_date', ['0000-00-00'])[0]
+                end = params.get('to_date', ['9999-99-99'])[0]
+                types = [int(x) for x in params.get('meal_type', [])]
+                with lib.plan_lock:
+                    plans = [p for p in lib.meal_plans.values() if start <= p['from_date'] <= end and (not types or p['meal_type']['id'] in types)]
+                return self._send(200, plans)
+        except (KeyError, ValueError, IndexError):
+            return self._send(404, {'detail': 'Not found.'})
+        return self._send(404, {'detail': 'Not found.'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self._count(url.path)
+        if self._throttled():
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        lib = self.server.library
+        if url.path.endswith('/api/meal-plan/'):
+            with lib.plan_lock:
+                pid = max(lib.meal_plans, default=0) + 1
+                lib._add_plan(pid, body['recipe']['id'], body['from_date'], body['meal_type']['id'])
+                plan = lib.meal_plans[pid]
+            return self._send(201, plan)
+        return self._send(404, {'detail': 'Not found.'})
+
+    def do_DELETE(self):
+        url = urlparse(self.path)
+        self._count(url.path)
+        if self._throttled():
+            return
+        lib = self.server.library
+        match = re.search(r'/api/meal-plan/(\d+)', url.path)
+        with lib.plan_lock:
+            if match and lib.meal_plans.pop(int(match.group(1)), None):
+                return self._send(204)
+        return self._send(404, {'detail': 'Not found.'})
+
+
+def make_server(host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, **library):
+    server = ThreadingHTTPServer((host, port), FakeTandoorHandler)
+    server.daemon_threads = True
+    server.library = FakeLibrary(**library)
+    server.latency = latency
+    server.error_rate = error_rate
+    server.random = random.Random(library.get('seed', 1))
+    server.stats = {'requests': Counter(), 'total': 0, 'bytes': 0, 'errors': 0}
+    return server
+
+
+def run_server(port_queue=None, **kwargs):
+    server = make_server(**kwargs)
+    if port_queue is not None:
+        port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic Tandoor library for benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--recipes', type=int, default=1000)
+    parser.add_argument('--keywords', type=int, default=200)
+    parser.add_argument('--foods', type=int, default=500)
+    parser.add_argument('--books', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request.')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Share of requests answered with 429 or 503.')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    server = make_server(
+        host=args.host, port=args.port, latency=args.latency, error_rate=args.error_rate,
+        recipes=args.recipes, keywords=args.keywords, foods=args.foods, books=args.books, seed=args.seed
+    )
+    print(f'Serving {args.recipes} recipes on http://{args.host}:{server.server_address[1]}/')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import pickle
+import shelve
+import socket
+import threading
+import time
+from datetime import datetime
+from urllib.parse import unquote, urlsplit
+
+
+class CacheBackend:
+    '''
+    storage behind the cached decorator; entries are dicts with the data and its expiry dates
+    '''
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, entry, expires):
+        '''
+        expires: datetime after which the entry can be dropped
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ShelveBackend(CacheBackend):
+    '''
+    a local shelve file, the default; shelve is not thread safe so every access holds a lock
+    '''
+
+    def __init__(self, path='caches.db'):
+        self.lock = threading.RLock()
+        try:
+            self.db = shelve.open(path, writeback=True)
+            keys_to_delete = [k for k in self.db if self.db[k].get('stale', self.db[k]['expired']) < datetime.now()]
+            for key in keys_to_delete:
+                self.db.pop(key)
+        except Exception:
+            self.db = {}
+
+    def get(self, key):
+        with self.lock:
+            return self.db.get(key)
+
+    def set(self, key, entry, expires):
+        with self.lock:
+            self.db[key] = entry
+            if hasattr(self.db, 'sync'):
+                self.db.sync()
+
+    def close(self):
+        with self.lock:
+            if hasattr(self.db, 'close'):
+                self.db.close()
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(CacheBackend):
+    '''
+    a Redis (or any RESP speaking) server shared by several machines
+    url: redis://[:password@]host[:port][/db]
+
+    entries are pickled, only point this at a server you trust.  When the server can't be
+    reached calls are treated as cache misses, a run never fails because of the cache, and
+    it isn't tried again for cooldown seconds so every call doesn't wait for the timeout.
+    '''
+
+    def __init__(self, url, logger=None, timeout=5, cooldown=60):
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.strip('/') or 0)
+        self.timeout = timeout
+        self.cooldown = cooldown
+        # monotonic time until which the server is treated as down
+        self.down_until = 0
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+        self.warned = False
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.reader = self.sock.makefile('rb')
+        if self.password:
+            self._send('AUTH', self.password)
+        if self.db:
+            self._send('SELECT', self.db)
+
+    def _disconnect(self):
+        for closable in (self.reader, self.sock):
+            try:
+                if closable:
+                    closable.close()
+            except OSError:
+                pass
+        self.sock = self.reader = None
+
+    def _send(self, *parts):
+        out = [b'*%d\r\n' % len(parts)]
+        for part in parts:
+            if not isinstance(part, bytes):
+                part = str(part).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(part), part))
+        self.sock.sendall(b''.join(out))
+        return self._read()
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the cache server.')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RedisError(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            if (length := int(rest)) < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            if (length := int(rest)) < 0:
+                return None
+            return [self._read() for _ in range(length)]
+        raise RedisError(f'Unexpected reply from the cache server: {line!r}')
+
+    def command(self, *parts):
+        with self.lock:
+            if time.monotonic() < self.down_until:
+                raise ConnectionError(f'The cache server at {self.host}:{self.port} is unavailable.')
+            # one retry on a fresh connection, the server may have closed an idle one
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    return self._send(*parts)
+                except (OSError, ConnectionError) as e:
+                    self._disconnect()
+                    if attempt:
+                        self.down_until = time.monotonic() + self.cooldown
+                        raise ConnectionError(f'Unable to reach the cache server at {self.host}:{self.port}: {e}')
+
+    def _unavailable(self, e):
+        if not self.warned and self.logger:
+            self.logger.warning(f'{e}; continuing without the shared cache.')
+        self.warned = True
+
+    def get(self, key):
+        try:
+            data = self.command('GET', key)
+        except (ConnectionError, RedisError) as e:
+            self._unavailable(e)
+            return None
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, entry, expires):
+        seconds = max(1, int((expires - datetime.now()).total_seconds()))
+        try:
+            self.command('SET', key, pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL), 'EX', seconds)
+        except (ConnectionError, RedisError) as e:
+            self._unavailable(e)
+
+    def close(self):
+        with self.lock:
+            self._disconnect()
+
+
+def open_backend(spec=None, logger=None):
+    '''
+    spec: redis:// url, a shelve file path, or None for caches.db in the working directory
+    '''
+    if spec and spec.startswith(('redis://', 'rediss://')):
+        if spec.startswith('rediss://'):
+            raise ValueError('TLS connections to the cache server are not supported, use redis://')
+        return RedisBackend(spec, logger=logger)
+    return ShelveBackend(spec or 'caches.db')
@@ -1,26 +1,31 @@
+import atexit
 import json
 import logging
 import os
 import sys
-
-import configargparse
-import yaml
+import time
 
 from mealplan import MealPlanManager
 from models import Book, Food, Keyword, Recipe
-from solver import RecipePicker
+from profiling import profiler
 from tandoor_api import TandoorAPI
-from utils import format_date, setup_logging, str2bool
+from tracing import tracer
+from utils import format_date, profile_startup, setup_logging, str2bool
 
 
 class Menu:
 
-    def __init__(self, options):
+    def __init__(self, options, tandoor=None, logger=None, recipes=None):
         self.options = options
         self.include_children = self.options.include_children
-        self.logger = setup_logging(log=self.options.log)
-        self.tandoor = TandoorAPI(self.options.url, self.options.token, self.logger, cache=int(self.options.cache))
+        self.logger = logger or setup_logging(log=self.options.log, file_level=self.options.log_file_level)
+        self.tandoor = tandoor or TandoorAPI(
+            self.options.url, self.options.token, self.logger, cache=int(self.options.cache), cache_policy=self.options.cache_policy, cache_backend=self.options.cache_backend,
+            retries=self.options.retries, rate_limit=self.options.rate_limit, rate_burst=self.options.rate_burst
+        )
         self.choices = int(self.options.choices)
+        # a recipe pool that was already fetched is reused instead of prepared again
+        self.recipe_pool = recipes
         self.recipes = []
         self.selected_recipes = []
         self.recipe_picker = None
@@ -30,6 +35,16 @@ class Menu:
         self.rating_constraints = []
         self.cookedon_constraints = []
         self.createdon_constraints = []
+        self._keywords = None
+        self._foods = None
+        self._pushdown = None
+        # recipes, hierarchies and books are read from a snapshot file instead of Tandoor
+        self.snapshot = None
+        if getattr(self.options, 'snapshot', None):
+            from snapshot import Snapshot
+            self.snapshot = Snapshot(self.options.snapshot)
+            if self.snapshot.has('meal_type'):
+                self.tandoor.meal_types.update((str(mt), meal_type) for mt, meal_type in self.snapshot.meal_types().items())
 
         self._format_constraints()
 
@@ -44,38 +59,124 @@ class Menu:
                 if y := x.get('created', None):
                     x['created'], x['created_after'] = format_date(y)
 
+    @property
+    def keywords(self):
+        # every keyword tree is answered from one closure table
+        if self._keywords is None:
+            self._keywords = self.snapshot.hierarchy('keyword') if self.snapshot else self.tandoor.get_keyword_hierarchy()
+        return self._keywords
+
+    @property
+    def foods(self):
+        if self._foods is None:
+            self._foods = self.snapshot.hierarchy('food') if self.snapshot else self.tandoor.get_food_hierarchy()
+        return self._foods
+
+    def keyword_tree(self, kw):
+        if kw in self.keywords:
+            return self.keywords.descendants(kw) if self.include_children else [self.keywords.node(kw)]
+        # created after the hierarchy was cached
+        tree = self.tandoor.get_keyword_tree(kw)
+        return tree if self.include_children else [k for k in tree if str(k['id']) == str(kw)]
+
+    def food_tree(self, food_ids):
+        ids = set()
+        for fd in food_ids:
+            if self.include_children and fd in self.foods:
+                ids |= self.foods.descendant_ids(fd)
+            else:
+                ids.add(fd)
+        return ids
+
+    def food_index(self):
+        '''
+        brings the local food index up to date within the budget
+
+        Returns:
+            FoodIndex, or None when the index is stale and the server has to be searched instead
+        '''
+        if self.snapshot:
+            # answers recipes_with from the food postings of the snapshot
+            return self.snapshot
+        from food_index import FoodIndex
+        index = FoodIndex(self.tandoor.url, self.logger)
+        if index.update(self.tandoor, self.tandoor.get_recipes(all_recipes=True), budget=int(self.options.food_index_budget)):
+            return index
+        self.logger.info('The food index is not up to date yet, searching recipes by food on the server.')
+        return None
+
+    def food(self, fd):
+        if fd in self.foods:
+            return self.foods.node(fd)
+        return self.tandoor.get_food(fd)
+
+    def pushdown_params(self):
+        '''
+        Returns:
+            recipe search parameters every chosen recipe has to match, empty when the whole library is needed
+        '''
+        if self._pushdown is None:
+            self._pushdown = {}
+            if self.options.pushdown and not self.options.recipes and not self.options.filters and not self.options.plan_type:
+                from planner import plan_pushdown
+                constraints = {kind: getattr(self, f'{kind}_constraints') for kind in ('keyword', 'rating', 'cookedon', 'createdon')}
+                self._pushdown = plan_pushdown(constraints, self.choices, self.logger)
+        return self._pushdown
+
+    @property
+    def plan_from(self):
+        return getattr(self.options, 'plan_from', None) or self.options.mp_date
+
+    @property
+    def plan_to(self):
+        return getattr(self.options, 'plan_to', None) or self.options.mp_date
+
     def prepare_recipes(self):
+        if self.snapshot:
+            self.recipes = self.snapshot.recipes()
+            return
         if not self.options.recipes and not self.options.filters and not self.options.plan_type:
-            for r in self.tandoor.get_recipes(all_recipes=True):
+            if params := self.pushdown_params():
+                recipes = self.tandoor.get_recipes(params=dict(params))
+            else:
+                recipes = self.tandoor.get_recipes(all_recipes=True)
+            for r in recipes:
                 self.recipes.append(Recipe(r))
         else:
             for r in self.tandoor.get_recipes(params=self.options.recipes, filters=self.options.filters):
                 self.recipes.append(Recipe(r))
-            for r in self.tandoor.get_mealplan_recipes(mealtype_id=self.options.plan_type, date=self.options.mp_date, params=self.options.recipes):
+            for r in self.tandoor.get_mealplan_recipes(mealtype_id=self.options.plan_type, date=self.plan_from, end=self.plan_to, params=self.options.recipes):
                 self.recipes.append(Recipe(r))
         self.recipes = list(set(self.recipes))
 
+    def book_memberships(self, book_ids, workers=8):
+        '''
+        fetches every book and its recipes once, several books at a time
+        book_ids: unique book ids
+
+        Returns:
+            dict of book id to the set of ids of its recipes
+        '''
+        if self.snapshot:
+            return {bk: self.snapshot.book_recipes(bk) for bk in book_ids}
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            books = list(executor.map(lambda bk: Book(self.tandoor.get_book(bk)), book_ids))
+            contents = executor.map(self.tandoor.get_book_recipes, books)
+            return {bk: {r['id'] for r in recipes} for bk, recipes in zip(book_ids, contents)}
+
     def prepare_books(self):
         for constraint in self.book_constraints:
-            if not isinstance(c := constraint['condition'], list):
-                constraint['condition'] = [c]
-            if not isinstance(c := constraint.get('except', []), list):
-                constraint['except'] = [c]
-
-            book_list = []
-            for bk in constraint['condition']:
-                book_list.append(Book(self.tandoor.get_book(bk)))
-            constraint['condition'] = book_list
-
-            book_list = []
-            for bk in constraint.get('except', []):
-                book_list.append(Book(self.tandoor.get_book(bk)))
-            constraint['except'] = book_list
+            constraint['condition'] = _as_list(constraint['condition'])
+            constraint['except'] = _as_list(constraint.get('except', []))
+        # a book used by several constraints is only resolved once
+        book_ids = list(dict.fromkeys(bk for c in self.book_constraints for bk in c['condition'] + c['except']))
+        memberships = self.book_memberships(book_ids) if book_ids else {}
 
-            found_recipes = []
-            for bk in constraint['condition']:
-                for r in self.tandoor.get_book_recipes(bk):
-                    found_recipes.append(Recipe(r))
+        for constraint in self.book_constraints:
+            found = set().union(*(memberships[bk] for bk in constraint['condition']))
+            found -= set().union(*(memberships[bk] for bk in constraint['except']))
+            found_recipes = [r for r in self.recipes if r.id in found]
 
             if cooked := constraint.get('cooked', None):
                 found_recipes = Recipe.recipesWithDate(found_recipes, 'cookedon', cooked, constraint.get('cooked_after', False))
@@ -85,6 +186,7 @@ class Menu:
             constraint['condition'] = found_recipes
 
     def prepare_foods(self):
+        index = self.food_index() if (self.options.food_index or self.snapshot) and self.food_constraints else None
         for constraint in self.food_constraints:
             if not isinstance(c := constraint['condition'], list):
                 constraint['condition'] = [c]
@@ -93,22 +195,27 @@ class Menu:
 
             food_list = []
             for fd in constraint['condition']:
-                food_list.append(Food(self.tandoor.get_food(fd)))
+                food_list.append(Food(self.food(fd)))
             constraint['condition'] = food_list
 
             food_list = []
             for fd in constraint.get('except', []):
-                food_list.append(Food(self.tandoor.get_food(fd)))
+                food_list.append(Food(self.food(fd)))
             constraint['except'] = food_list
 
-            # recipe api doesn't include ingredients, so get a list of ingredients with the food
-            params = {
-                'foods_or': [f.id for f in constraint['condition']],
-                'foods_or_not': [f.id for f in constraint['except']]
-            }
-            found_recipes = []
-            for r in self.tandoor.get_recipes(params=params):
-                found_recipes.append(Recipe(r))
+            if index:
+                found = index.recipes_with(self.food_tree(f.id for f in constraint['condition']))
+                found -= index.recipes_with(self.food_tree(f.id for f in constraint['except']))
+                found_recipes = [r for r in self.recipes if r.id in found]
+            else:
+                # recipe api doesn't include ingredients, so get a list of ingredients with the food
+                params = {
+                    'foods_or': [f.id for f in constraint['condition']],
+                    'foods_or_not': [f.id for f in constraint['except']]
+                }
+                found_recipes = []
+                for r in self.tandoor.get_recipes(params=params):
+                    found_recipes.append(Recipe(r))
             if cooked := constraint.get('cooked', None):
                 found_recipes = Recipe.recipesWithDate(found_recipes, 'cookedon', cooked, constraint.get('cooked_after', False))
             if created := constraint.get('created', None):
@@ -124,22 +231,174 @@ class Menu:
             if not isinstance(c := constraint.get('except', []), list):
                 constraint['except'] = [c]
             kw_tree = []
-            if self.include_children:
-                for kw in constraint['condition']:
-                    kw_tree += self.tandoor.get_keyword_tree(kw)
-            else:
-                for kw in constraint['condition']:
-                    kw_tree.append(self.tandoor.get_food(kw))
+            for kw in constraint['condition']:
+                kw_tree += self.keyword_tree(kw)
             constraint['condition'] = list(set([Keyword(k) for k in kw_tree]))
 
     def prepare_data(self):
+        with profiler.stage('prepare_data'):
+            self._prepare_data()
+
+    def _prepare_data(self):
+        with tracer.span('prepare_recipes'):
+            if self.recipe_pool is None:
+                self.prepare_recipes()
+            else:
+                self.recipes = list(self.recipe_pool)
+        with tracer.span('prepare_keywords'):
+            self.prepare_keywords()
+        with tracer.span('prepare_foods'):
+            self.prepare_foods()
+        with tracer.span('prepare_books'):
+            self.prepare_books()
+
+    def fetch_plan(self, refresh=False):
+        '''
+        lists the cached API calls prepare_data and create_meal_plans will make, with the same
+        arguments so they share cache keys.  Book contents depend on the book, so they are a
+        second phase of calls that is only known once the first one finished.
+
+        Returns:
+            list of (description, function) for the first phase, function(results) listing the second phase
+        '''
+        api = self.tandoor
+        calls = {}
+
+        def _add(description, func, *args, **kwargs):
+            calls.setdefault(description, lambda: func(*args, refresh=refresh, **kwargs))
+
+        if not self.options.recipes and not self.options.filters and not self.options.plan_type:
+            if params := self.pushdown_params():
+                _add(f'recipes {params}', api.get_recipes, params=dict(params))
+            else:
+                _add('all recipes', api.get_recipes, all_recipes=True)
+        else:
+            _add(f'recipes {self.options.recipes} {self.options.filters}', api.get_recipes, params=dict(self.options.recipes or {}), filters=list(self.options.filters))
+            plan_range = f"{self.plan_from.strftime('%Y-%m-%d')} {self.plan_to.strftime('%Y-%m-%d')}"
+            _add(f'meal plan recipes {self.options.plan_type} {plan_range} {self.options.recipes}', api.get_mealplan_recipes, mealtype_id=self.options.plan_type, date=self.plan_from, end=self.plan_to, params=dict(self.options.recipes or {}))
+
+        if self.keyword_constraints:
+            _add('keywords', api.get_keyword_hierarchy)
+        if self.food_constraints:
+            _add('foods', api.get_food_hierarchy)
+        for constraint in self.food_constraints:
+            foods, excluded = _as_list(constraint['condition']), _as_list(constraint.get('except', []))
+            params = {'foods_or': [int(f) for f in foods], 'foods_or_not': [int(f) for f in excluded]}
+            _add(f'food recipes {params}', api.get_recipes, params=params)
+
+        books = set()
+        for constraint in self.book_constraints:
+            for bk in _as_list(constraint['condition']) + _as_list(constraint.get('except', [])):
+                _add(f'book {bk}', api.get_book, bk)
+            books.update(_as_list(constraint['condition']) + _as_list(constraint.get('except', [])))
+
+        if self.options.create_mp and self.options.mp_type:
+            _add(f'meal type {self.options.mp_type}', api.get_unpaged_results, f'{api.url}meal-type/', self.options.mp_type)
+
+        def _book_contents(results):
+            return [
+                (f'book recipes {bk}', lambda book=Book(results[f'book {bk}']): api.get_book_recipes(book, refresh=refresh))
+                for bk in books if f'book {bk}' in results
+            ]
+        return list(calls.items()), _book_contents
+
+    def warm_cache(self, workers=8):
+        '''
+        fetches everything a run with these options needs and stores it in the cache with a fresh
+        expiry, without solving
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        calls, book_contents = self.fetch_plan(refresh=True)
+        start = time.perf_counter()
+        results = {}
+        failed = []
+
+        def _run(phase):
+            futures = {description: executor.submit(func) for description, func in phase}
+            for description, future in futures.items():
+                try:
+                    results[description] = future.result()
+                    self.logger.debug(f'Warmed {description}.')
+                except Exception as e:
+                    failed.append(description)
+                    self.logger.warning(f'Unable to warm {description}: {e}')
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            _run(calls)
+            _run(book_contents(results))
+        self.tandoor.reset_memo()
+        self.logger.info(f'Warmed the cache with {len(results)} API calls in {time.perf_counter() - start:.1f} seconds.')
+        return not failed
+
+    def export_snapshot(self, path):
+        '''
+        fetches everything a run with these options needs and writes it to a snapshot file that
+        runs with --snapshot read instead of Tandoor, see snapshot.py
+        '''
+        from snapshot import write_snapshot
+        start = time.perf_counter()
         self.prepare_recipes()
-        self.prepare_keywords()
-        self.prepare_foods()
-        self.prepare_books()
+        book_ids = list(dict.fromkeys(bk for c in self.book_constraints for bk in _as_list(c['condition']) + _as_list(c.get('except', []))))
+        memberships = self.book_memberships(book_ids) if book_ids else {}
+        books = {bk: self.tandoor.get_book(bk) for bk in book_ids}
+        postings = None
+        if self.food_constraints:
+            from food_index import FoodIndex
+            index = FoodIndex(self.tandoor.url, self.logger)
+            recipes = self.tandoor.get_recipes(all_recipes=True)
+            if not index.update(self.tandoor, recipes, budget=len(recipes)):
+                raise RuntimeError('Unable to index the foods of every recipe, a snapshot for food conditions would be incomplete.')
+            postings = index.postings
+        meal_types = {}
+        if self.options.mp_type:
+            meal_types[int(self.options.mp_type)] = self.tandoor.get_unpaged_results(f'{self.tandoor.url}meal-type/', self.options.mp_type)
+        write_snapshot(
+            path, self.recipes, keywords=self.keywords, foods=self.foods, books=books, memberships=memberships,
+            postings=postings, meal_types=meal_types, source=self.tandoor.url
+        )
+        self.logger.info(f'Exported {len(self.recipes)} recipes to {path} in {time.perf_counter() - start:.1f} seconds.')
 
     def select_recipes(self):
-        self.recipe_picker = RecipePicker(self.recipes, self.choices, logger=self.logger)
+        sample = int(self.options.sample_pool or 0)
+        if sample and len(self.recipes) > sample:
+            from solver import sample_pool
+            specs = self.constraint_specs()
+            candidates = sample_pool(self.recipes, self.choices, specs, sample, logger=self.logger)
+            self.logger.debug(f'Sampled {len(candidates)} of {len(self.recipes)} recipes to choose from.')
+            try:
+                return self._select_recipes(candidates, specs, report=False)
+            except RuntimeError:
+                self.logger.info('No solution with the sampled recipes, solving with all of them.')
+            return self._select_recipes(self.recipes, specs)
+        return self._select_recipes()
+
+    def _select_recipes(self, recipes=None, specs=None, report=True):
+        recipes = self.recipes if recipes is None else recipes
+        with tracer.span('model_build', pool=len(recipes)), profiler.stage('build_model'):
+            self.build_model(recipes, specs)
+        with profiler.stage('solve'):
+            self.selected_recipes = self.recipe_picker.solve(report=report)
+        return self.selected_recipes
+
+    def build_model(self, recipes=None, specs=None):
+        '''
+        recipes: recipes to choose from, defaults to every prepared recipe
+        specs: constraint specs already evaluated on the prepared recipes, see constraint_specs
+        '''
+        from solver import RecipePicker
+        self.recipe_picker = RecipePicker(self.recipes if recipes is None else recipes, self.choices, logger=self.logger)
+        for kind, found_recipes, count, operator, exclude in (self.constraint_specs() if specs is None else specs):
+            self.recipe_picker.add_constraint(kind, found_recipes, count, operator, exclude=exclude)
+        return self.recipe_picker
+
+    def constraint_specs(self):
+        '''
+        evaluates every constraint against the prepared recipes
+
+        Returns:
+            list of (kind, found recipes, count, operator, exclude)
+        '''
+        specs = []
         # add keyword constraints
         for c in self.keyword_constraints:
             exclude = str2bool(c.get('exclude', False))
@@ -148,17 +407,17 @@ class Menu:
                 found_recipes = Recipe.recipesWithDate(found_recipes, 'cookedon', cooked, c.get('cooked_after', False))
             if created := c.get('created', None):
                 found_recipes = Recipe.recipesWithDate(found_recipes, 'createdon', created, c.get('created_after', False))
-            self.recipe_picker.add_keyword_constraint(found_recipes, c['count'], c['operator'], exclude=exclude)
+            specs.append(('keyword', found_recipes, c['count'], c['operator'], exclude))
 
         # add food constraints
         for c in self.food_constraints:
             exclude = str2bool(c.get('exclude', False))
-            self.recipe_picker.add_food_constraint(c['condition'], c['count'], c['operator'], exclude=exclude)
+            specs.append(('food', c['condition'], c['count'], c['operator'], exclude))
 
         # add book constraints
         for c in self.book_constraints:
             exclude = str2bool(c.get('exclude', False))
-            self.recipe_picker.add_book_constraint(c['condition'], c['count'], c['operator'], exclude=exclude)
+            specs.append(('book', c['condition'], c['count'], c['operator'], exclude))
 
         # add rating contraints
         for c in self.rating_constraints:
@@ -168,7 +427,7 @@ class Menu:
                 found_recipes = Recipe.recipesWithDate(found_recipes, 'cookedon', cooked, after=c.get('cooked_after', False))
             if created := c.get('created', None):
                 found_recipes = Recipe.recipesWithDate(found_recipes, 'createdon', created, after=c.get('created_after', False))
-            self.recipe_picker.add_rating_constraints(Recipe.recipesWithRating(found_recipes, c.get('condition')), c['count'], c['operator'], exclude=exclude)
+            specs.append(('rating', Recipe.recipesWithRating(found_recipes, c.get('condition')), c['count'], c['operator'], exclude))
 
         # add cookedon constraints
         for c in self.cookedon_constraints:
@@ -177,7 +436,7 @@ class Menu:
             found_recipes = Recipe.recipesWithDate(self.recipes, 'cookedon', d, after=a)
             if created := c.get('created', None):
                 found_recipes = Recipe.recipesWithDate(found_recipes, 'createdon', created, after=c.get('created_after', False))
-            self.recipe_picker.add_cookedon_constraints(found_recipes, c['count'], c['operator'], exclude=exclude)
+            specs.append(('cookedon', found_recipes, c['count'], c['operator'], exclude))
 
         # add createdon constraints
         for c in self.createdon_constraints:
@@ -186,19 +445,42 @@ class Menu:
             found_recipes = Recipe.recipesWithDate(self.recipes, 'createdon', d, after=a)
             if cookedon := c.get('cookedon', None):
                 found_recipes = Recipe.recipesWithDate(found_recipes, 'cookedon', cookedon, after=c.get('cookedon_after', False))
-            self.recipe_picker.add_createdon_constraints(found_recipes, c['count'], c['operator'], exclude=exclude)
+            specs.append(('createdon', found_recipes, c['count'], c['operator'], exclude))
+        return specs
 
-        self.selected_recipes = self.recipe_picker.solve()
-        return self.selected_recipes
+    def create_meal_plans(self, recipes):
+        with profiler.stage('meal_plans'):
+            self._create_meal_plans(recipes)
+
+    def _create_meal_plans(self, recipes):
+        mpm = MealPlanManager(self.tandoor, self.logger)
+        if self.options.cleanup_mp:
+            with tracer.span('cleanup_meal_plans'):
+                mpm.cleanup_uncooked(date=self.options.cleanup_date, mp_type=self.options.mp_type)
+        with tracer.span('create_meal_plans', count=len(recipes)):
+            mpm.create_from_recipes(recipes, self.options.mp_type, date=self.options.mp_date, note=self.options.mp_note, share=self.options.share_with)
 
     def generate_menu_file(self, recipes):
         from menu import MenuGenerator
         self.logger.info('Generating menu file, this may take awhile.')
         menu_gen = MenuGenerator(self.tandoor, self.options, self.logger)
-        menu_gen.write_menu(recipes)
+        with tracer.span('render'), profiler.stage('render'):
+            menu_gen.write_menu(recipes)
+
+    def generate_menu_files(self, jobs, workers=None):
+        from menu import render_batch
+        self.logger.info(f'Generating {len(jobs)} menu files, this may take awhile.')
+        with tracer.span('render_batch', jobs=len(jobs)), profiler.stage('render'):
+            return render_batch(self.tandoor, self.options, jobs, self.logger, workers=workers)
+
 
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
 
-def parse_args():
+
+def parse_args(argv=None):
+    import configargparse
+    import yaml
     parser = configargparse.ArgParser(
         config_file_parser_class=configargparse.ConfigparserConfigFileParser,
         description='Create a custom menu from recipes in Tandoor with defined criteria.'
@@ -206,20 +488,40 @@ def parse_args():
     # application related switches
     parser.add_argument('-c', '--my-config', is_config_file=True, default='config.ini', help='Specify configuration file.')
     parser.add_argument('--log', default='info', help='Sets the logging level')
+    parser.add_argument('--log_file_level', default='debug', help='Sets the logging level of cocktail-menu.log')
     parser.add_argument('--cache', default='240', help='Minutes to cache Tandoor API results; 0 to disable.')
+    parser.add_argument('--cache_policy', type=yaml.safe_load, help="Minutes to cache each endpoint, e.g. {'keyword': 10080, 'recipe': {'ttl': 60, 'stale': 1440}}; other endpoints use --cache.")
+    parser.add_argument('--cache_backend', type=str, help='Where to cache API results: a file (default caches.db) or redis://host:port/db to share the cache between machines.')
+    parser.add_argument('--retries', type=int, default=3, help='Times to retry a request when Tandoor is busy or unreachable.')
+    parser.add_argument('--rate_limit', type=float, default=0, help='Most requests per second to send to Tandoor; 0 for no limit.')
+    parser.add_argument('--rate_burst', type=int, default=10, help='Requests that may be sent at once before rate_limit applies.')
+    parser.add_argument('--warm-cache', action='store_true', default=False, help='Fetch everything the configured run needs into the cache and exit without choosing recipes.')
+    parser.add_argument('--export_snapshot', type=str, help='Write everything the configured run needs to this snapshot file and exit without choosing recipes.')
+    parser.add_argument('--snapshot', type=str, help='Read recipes, keywords, foods and books from this snapshot file instead of Tandoor.')
+    parser.add_argument('--trace_file', type=str, help='Write timing spans of the run to this file in Chrome trace (JSON) format.')
+    parser.add_argument('--metrics_file', type=str, help='Write metrics of the run to this file in Prometheus text format.')
+    parser.add_argument('--profile', type=str, help='Profile each stage of the run and write the profiles and a collapsed-stack file to this directory.')
+    parser.add_argument('--startup-profile', action='store_true', default=False, help='Report the import time of every module loaded during the run.')
     parser.add_argument('--url', type=str, required=True, help='The full url of the Tandoor server, including protocol, name, port and path')
     parser.add_argument('--token', type=str, required=True, help='Tandoor API token.')
     # solver related switches
     parser.add_argument('--recipes', type=yaml.safe_load, help='recipes to choose from; search parameters, see /docs/api/ for full list of parameters')
     parser.add_argument('--filters', nargs='*', default=[], help='Array of CustomFilter IDs')
     parser.add_argument('--plan_type', nargs='*', default=[], help='Array of MealType IDs')
+    parser.add_argument('--plan_from', type=str, help="First day of meal plans to take plan_type recipes from, in YYYY-MM-DD format, 'XXdays' ahead or '-XXdays' ago; defaults to mp_date.")
+    parser.add_argument('--plan_to', type=str, help='Last day of meal plans to take plan_type recipes from; defaults to mp_date.')
     parser.add_argument('--choices', default=5, help='Number of recipes to choose')
+    parser.add_argument('--sample_pool', type=int, default=0, help='Solve with a sample of about this many recipes that keeps every constraint satisfiable; 0 to use every recipe.')
+    parser.add_argument('--scenarios', type=str, help='YAML file of constraint variants to solve in parallel and report on, without creating anything.')
     parser.add_argument('--book', nargs='*', default=[], help="Conditions are all list of dicts of the format {'condition':xx, 'count':yy, 'operator': [>= or <= or ==]}")
     parser.add_argument('--food', nargs='*', default=[], help='Condition = ID or list of IDs')
     parser.add_argument('--keyword', nargs='*', default=[], help="e.g. [{'condition':[73, 273],'count':'1', 'operator':'>='},{'condition':47,'count':'2','operator':'=='}]")
     parser.add_argument('--rating', nargs='*', default=[], help='condition = number between 0 and 5')
     parser.add_argument('--cookedon', nargs='*', default=[], help="condition = date in YYYY-MM-DD format (use 'XXdays' for relative date XX days ago)")
     parser.add_argument('--createdon', nargs='*', default=[], help="condition = date in YYYY-MM-DD format (use 'XXdays' for relative date XX days ago)")
+    parser.add_argument('--food_index', action='store_true', default=False, help='Answer food conditions from a local index of recipe ingredients instead of searching the server.')
+    parser.add_argument('--food_index_budget', default=100, help='Most recipes to add to the food index per run; the server is searched until the index is complete.')
+    parser.add_argument('--pushdown', action='store_true', default=False, help='Only fetch the recipes that can satisfy the rating, date and keyword conditions instead of the whole library.')
     parser.add_argument('--include_children', action='store_true', default=True, help='For keywords and foods, child objects also satisfy the condition.')
     # mealplan related switches
     parser.add_argument('--create_mp', action='store_true', default=False, help='Add mealplans for chosen recipes.')
@@ -229,26 +531,47 @@ def parse_args():
     parser.add_argument('--mp_note', type=str, default='Created by: Tandoor Menu Generator.')
     parser.add_argument('--cleanup_mp', action='store_true', default=False, help='Delete uncooked mealplans at next execution.')
     parser.add_argument('--cleanup_date', type=str, default='-7days', help='Starting date to cleanup uncooked mealplans in YYYY-MM-DD format or -XXdays.')
+    parser.add_argument('--cleanup_only', action='store_true', default=False, help='Only delete uncooked mealplans of mp_type, without choosing recipes.')
     # menu file creation related switches
     parser.add_argument('--create_file', action='store_true', default=False, help='Create a menu from an SVG template.')
-    parser.add_argument('--file_format', type=str, default='PNG', help='File format to save the menu. Options: GIF, JPG, PNG, PDF.')
+    parser.add_argument('--file_format', nargs='*', default=['PNG'], help='File format(s) to save the menu. Options: GIF, JPG, PNG, PDF.')
     parser.add_argument('--output_dir', type=str, help='Defaults to template dir.  Full path required.')
     parser.add_argument('--file_template', type=str, help='Name of SVG file located in templates/ directory.')
     parser.add_argument('--fonts', nargs='*', default=[], help='Non-system fonts required for the SVG template.')
     parser.add_argument('--replace_text', type=yaml.safe_load, help='Text to search for in the template and replace with menu details.')
     parser.add_argument('--separator', type=str, default=' - ', help='Separator to use when concatenating ingredients.')
 
-    args = parser.parse_args()
+    # server mode
+    parser.add_argument('--serve', nargs='?', const='127.0.0.1:8787', help='Run as a server on HOST:PORT or a unix socket path instead of exiting after one menu.')
+
+    args = parser.parse_args(args=argv)
     args.separator = args.separator.replace("'", "").replace('"', '')
     return args
 
 
+def _plan_date(value):
+    # plan ranges look both ways: XXdays is ahead like mp_date, -XXdays is ago like cleanup_date
+    return format_date(value, future=not value.startswith('-'))[0]
+
+
 def validate_args(args):
     valid = True
     args.mp_date, _ = format_date(args.mp_date, future=True)
+    if args.plan_from or args.plan_to:
+        args.plan_from = _plan_date(args.plan_from) if args.plan_from else args.mp_date
+        args.plan_to = _plan_date(args.plan_to) if args.plan_to else args.mp_date
+        if args.plan_to.date() < args.plan_from.date():
+            raise RuntimeError('"plan_to" must not be before "plan_from".')
     if not args.output_dir:
         args.output_dir = os.path.join(os.getcwd(), 'templates')
-    if args.create_mp:
+    if args.cleanup_only:
+        try:
+            args.mp_type = int(args.mp_type)
+        except (ValueError, TypeError):
+            raise RuntimeError('"cleanup_only" requires "mp_type" to be a valid Meal Type ID.')
+        args.cleanup_date, _ = format_date(args.cleanup_date)
+        print(f'Uncooked meal plans will be cleaned up beginning on {args.cleanup_date.strftime("%Y-%m-%d")} with meal type {args.mp_type}.')
+    elif args.create_mp:
         if not (args.mp_date and args.mp_type):
             valid = False
             raise RuntimeError('When "create_mp" is enabled, both "mp_date" and "mp_type" must be provided.')
@@ -266,10 +589,37 @@ def validate_args(args):
 
 if __name__ == "__main__":
     args = parse_args()
+    if args.startup_profile and 'importtime' not in sys._xoptions:
+        sys.exit(profile_startup(sys.argv))
+    if args.trace_file or args.metrics_file:
+        tracer.enable()
+        atexit.register(tracer.export, trace_file=args.trace_file, metrics_file=args.metrics_file)
+    if args.profile:
+        profiler.enable(args.profile)
+        atexit.register(profiler.close)
+    if args.serve:
+        from server import serve
+        serve(args, sys.argv[1:])
+        sys.exit(0)
     validate_args(args)
     menu = Menu(args)
     for arg in args._get_kwargs():
         menu.logger.debug(f'Argument {arg[0]}: {arg[1]}')
+
+    if args.warm_cache:
+        sys.exit(0 if menu.warm_cache() else 1)
+    if args.export_snapshot:
+        menu.export_snapshot(args.export_snapshot)
+        sys.exit(0)
+    if args.scenarios:
+        from scenarios import ScenarioExplorer, load_scenarios
+        explorer = ScenarioExplorer(menu, load_scenarios(args.scenarios), menu.logger)
+        explorer.run()
+        print(explorer.report())
+        sys.exit(0)
+    if args.cleanup_only:
+        MealPlanManager(menu.tandoor, menu.logger).cleanup_uncooked(date=args.cleanup_date, mp_type=args.mp_type)
+        sys.exit(0)
     menu.prepare_data()
 
     if len(menu.recipes) < menu.choices:
@@ -279,14 +629,11 @@ if __name__ == "__main__":
     recipes = menu.select_recipes()
 
     menu.logger.info(f'Selected {len(recipes)} recipes for the menu.')
-    if menu.logger.loglevel == logging.DEBUG:
+    if menu.logger.isEnabledFor(logging.DEBUG):
         for r in recipes:
             date_cooked = (x := getattr(r, 'cookedon', None)) and x.strftime("%Y-%m-%d") or "Never"
-            menu.logger.debug(f'Selected recipe {r} for the menu with rating {r.rating}. Created on: {r.createdon.strftime("%Y-%m-%d")} and last cooked {date_cooked}')
-            kw_list = []
-            for kw in r.keywords:
-                kw_list.append(kw)
-            menu.logger.debug(f'Selected recipe {r} contains keywords {kw_list}.')
+            menu.logger.debug('Selected recipe %s for the menu with rating %s. Created on: %s and last cooked %s', r, r.rating, r.createdon.strftime("%Y-%m-%d"), date_cooked)
+            menu.logger.debug('Selected recipe %s contains keywords %s.', r, r.keywords)
 
     print('\n\n###########################\nYour selected recipes are:')
     for r in recipes:
@@ -294,10 +641,7 @@ if __name__ == "__main__":
 
     print('###########################\n')
     if args.create_mp:
-        mpm = MealPlanManager(menu.tandoor, menu.logger)
-        if args.cleanup_mp:
-            mpm.cleanup_uncooked(date=args.cleanup_date, mp_type=args.mp_type)
-        mpm.create_from_recipes(recipes, args.mp_type, date=args.mp_date, note=args.mp_note, share=args.share_with)
+        menu.create_meal_plans(recipes)
 
     if args.create_file:
         menu.generate_menu_file(recipes)
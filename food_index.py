@@ -0,0 +1,94 @@
+import shelve
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FoodIndex:
+    '''
+    persistent food -> recipe inverted index built from recipe details
+    url: tandoor api url the index belongs to, one file can hold indexes of several servers
+    path: shelve file the index is stored in
+
+    recipes are re-indexed when their updated_at changes; food constraints are answered
+    with set operations on the postings instead of a recipe search per constraint
+    '''
+
+    def __init__(self, url, logger, path='food_index.db'):
+        self.url = url
+        self.logger = logger
+        self.path = path
+        self.recipes = {}
+        self.fresh = False
+        self._postings = None
+        try:
+            with shelve.open(self.path) as db:
+                self.recipes = db.get(self.url, {})
+        except Exception as e:
+            self.logger.warning(f'Unable to read food index {self.path}, it will be rebuilt: {e}')
+
+    def save(self):
+        try:
+            with shelve.open(self.path) as db:
+                db[self.url] = self.recipes
+        except Exception as e:
+            self.logger.warning(f'Unable to save food index {self.path}: {e}')
+
+    def update(self, api, recipes, budget=100, workers=8):
+        '''
+        indexes new and changed recipes and drops deleted ones
+        api: TandoorAPI to fetch recipe details with
+        recipes: every recipe in tandoor format, with updated_at
+        budget: most recipe details to fetch in this run
+
+        Returns:
+            True if the index is complete and current
+        '''
+        current = {r['id']: r.get('updated_at') for r in recipes}
+        for rid in set(self.recipes) - set(current):
+            del self.recipes[rid]
+        # a recipe without updated_at can't be checked, it is fetched every time
+        stale = [rid for rid, updated in current.items() if updated is None or self.recipes.get(rid, {}).get('updated_at') != updated]
+
+        def _fetch(rid):
+            details = api.get_recipe_details(rid, ttl=0)
+            foods = {i['food']['id'] for s in details.get('steps', []) for i in s.get('ingredients', []) if i.get('food')}
+            return rid, {'updated_at': current[rid], 'foods': sorted(foods)}
+
+        failed = 0
+        if stale[:budget]:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_fetch, rid) for rid in stale[:budget]]
+                for future in futures:
+                    try:
+                        rid, entry = future.result()
+                        self.recipes[rid] = entry
+                    except Exception as e:
+                        failed += 1
+                        self.logger.debug(f'Unable to index recipe: {e}')
+            self.save()
+            # the details are in the index now, don't keep their responses for the rest of the run
+            api.reset_memo()
+
+        self._postings = None
+        self.fresh = len(stale) <= budget and not failed and all(current.values())
+        self.logger.debug(f'Food index has {len(self.recipes)} recipes; indexed {min(len(stale), budget) - failed} of {len(stale)} changed recipes.')
+        return self.fresh
+
+    @property
+    def postings(self):
+        if self._postings is None:
+            self._postings = defaultdict(set)
+            for rid, entry in self.recipes.items():
+                for food in entry['foods']:
+                    self._postings[food].add(rid)
+        return self._postings
+
+    def recipes_with(self, food_ids):
+        '''
+        Returns:
+            set of ids of the recipes that use any of the foods
+        '''
+        found = set()
+        for food in food_ids:
+            found |= self.postings.get(food, set())
+        return found
@@ -0,0 +1,53 @@
+def _parent_id(node):
+    parent = node.get('parent')
+    if isinstance(parent, dict):
+        return parent.get('id')
+    return parent
+
+
+def _as_id(node_id):
+    try:
+        return int(node_id)
+    except (TypeError, ValueError):
+        return node_id
+
+
+class Hierarchy:
+    '''
+    closure table of a keyword or food tree, built from the complete list of objects
+    nodes: list of keywords or foods in tandoor format, each with its parent id
+
+    every node is mapped to itself and all of its descendants, so looking up a subtree
+    doesn't need the API
+    '''
+
+    def __init__(self, nodes):
+        self.nodes = {n['id']: n for n in nodes}
+        self.closure = {node_id: {node_id} for node_id in self.nodes}
+        for node_id, node in self.nodes.items():
+            parent = _parent_id(node)
+            seen = set()
+            # walk up to the root, adding the node to each ancestor; seen guards against cycles
+            while parent in self.closure and parent not in seen:
+                seen.add(parent)
+                self.closure[parent].add(node_id)
+                parent = _parent_id(self.nodes[parent])
+
+    def __contains__(self, node_id):
+        return _as_id(node_id) in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def node(self, node_id):
+        return self.nodes[_as_id(node_id)]
+
+    def descendant_ids(self, node_id):
+        return self.closure[_as_id(node_id)]
+
+    def descendants(self, node_id):
+        '''
+        Returns:
+            list of the node and all of its descendants in tandoor format
+        '''
+        return [self.nodes[i] for i in self.closure[_as_id(node_id)]]
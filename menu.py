@@ -2,15 +2,179 @@ import json
 import logging
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from copy import copy, deepcopy
 from datetime import datetime
 from shutil import copy2
 
+from lxml import etree
 from reportlab.graphics import renderPDF, renderPM
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from svglib.svglib import svg2rlg
+from svglib.svglib import SvgRenderer
 
-from utils import printable_date
+from tracing import tracer
+from utils import init_worker_logging, log_queue, printable_date
+
+# fonts already registered with reportlab in this process
+_registered_fonts = set()
+_worker_logger = None
+
+
+def file_formats(formats):
+    '''
+    normalizes the file_format option into a list of unique formats
+    formats: string or list of strings, each may be comma separated
+
+    Returns:
+        list of formats in the order requested
+    '''
+    if isinstance(formats, str):
+        formats = [formats]
+    result = []
+    for fmt in formats or []:
+        for f in str(fmt).split(','):
+            f = f.strip().strip('\'"')
+            if f and f.upper() not in [x.upper() for x in result]:
+                result.append(f)
+    return result or ['PNG']
+
+
+def assign_slots(cost):
+    '''
+    solves the assignment problem with the Hungarian algorithm in O(n^2 * m)
+    cost: n x m matrix (n <= m), cost[slot][item] of placing item in slot
+
+    Returns:
+        list with the index of the item assigned to each slot, minimizing the total cost
+    '''
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    if n > m:
+        raise ValueError(f'Unable to assign {n} slots to {m} items, there must be at least as many items as slots.')
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    match = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = [float('inf')] * (m + 1)
+        used = [False] * (m + 1)
+        while match[j0] != 0:
+            used[j0] = True
+            i0 = match[j0]
+            delta = float('inf')
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    result = [0] * n
+    for j in range(1, m + 1):
+        if match[j]:
+            result[match[j] - 1] = j - 1
+    return result
+
+
+def register_fonts(fonts, template_dir, logger):
+    for f in fonts:
+        if isinstance(f, str):
+            f = json.loads(f.replace("'", '"'))
+        if f['name'] in _registered_fonts:
+            continue
+        logger.debug(f'Loading font {f["name"]} from {os.path.join(template_dir, f["file"])}.')
+        font = TTFont(f['name'], os.path.join(template_dir, f['file']))
+        pdfmetrics.registerFont(font)
+        _registered_fonts.add(f['name'])
+        logger.debug(f'Font {font.fontName} loaded succesfully.')
+
+
+def _init_render_worker(fonts, template_dir, loglevel, log_queue, level):
+    global _worker_logger
+    _worker_logger = init_worker_logging(log_queue, level)
+    _worker_logger.loglevel = loglevel
+    register_fonts(fonts, template_dir, _worker_logger)
+
+
+def _render_job(options):
+    return MenuGenerator(None, options, _worker_logger).write_menu(options.menu_recipes)
+
+
+def render_batch(api, options, jobs, logger, workers=None, return_exceptions=False):
+    '''
+    renders many menus across a process pool
+    api: TandoorAPI used to load ingredient details before the jobs are dispatched
+    options: base options, each job overrides the template specific values
+    jobs: list of dicts with keys 'template', 'recipes' and optionally 'date', 'replace_text',
+          'output_name', 'output_dir', 'file_format' and 'fonts'
+    workers: number of worker processes, defaults to the number of cores
+    return_exceptions: (bool) return the exception of a failed job instead of raising it
+
+    Returns:
+        list of output files for each job, in the order of jobs
+    '''
+    job_options = []
+    output_names = set()
+    for idx, job in enumerate(jobs):
+        opts = copy(options)
+        opts.file_template = job['template']
+        opts.menu_recipes = job['recipes']
+        opts.mp_date = job.get('date', None) or options.mp_date
+        opts.replace_text = job.get('replace_text', None) or options.replace_text
+        opts.output_dir = job.get('output_dir', None) or options.output_dir
+        opts.file_format = job.get('file_format', None) or options.file_format
+        opts.fonts = job.get('fonts', None) or options.fonts
+        # every job writes its own files, even when rendering the same template for the same date
+        name = job.get('output_name', None) or f"{job['template'].split('.')[0]}-{opts.mp_date.strftime('%Y-%m-%d')}"
+        if (os.path.join(opts.output_dir or '', name)) in output_names:
+            name = f'{name}_{idx}'
+        output_names.add(os.path.join(opts.output_dir or '', name))
+        opts.output_name = name
+        job_options.append(opts)
+
+    # ingredient details need the API, so load them once here rather than in the workers
+    detailed = {}
+    for opts in job_options:
+        if any('ingredients' in r for r in opts.replace_text['recipe_text']):
+            for r in opts.menu_recipes:
+                if r.id not in detailed:
+                    r.addDetails(api)
+                    detailed[r.id] = r
+                elif r is not detailed[r.id]:
+                    r.ingredients = detailed[r.id].ingredients
+
+    template_dir = os.path.join(os.getcwd(), 'templates')
+    logger.info(f'Rendering {len(job_options)} menus with {workers or os.cpu_count()} workers.')
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker, initargs=(options.fonts, template_dir, logger.loglevel, log_queue(), logger.level)) as pool:
+        futures = [pool.submit(_render_job, opts) for opts in job_options]
+        for opts, f in zip(job_options, futures):
+            try:
+                results.append(f.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                logger.error(f'Failed to render menu {opts.output_name}: {e}')
+                results.append(e)
+    return results
 
 
 class MenuGenerator:
@@ -21,47 +185,72 @@ class MenuGenerator:
         self.template_dir = os.path.join(os.getcwd(), 'templates')
         self.output_dir = options.output_dir or self.template_dir
         self.input_file = options.file_template
-        self.temp_file = os.path.join(self.output_dir, 'temp.svg')
-        self.output_file = self.input_file.split('.')[0]
-        self.ext = options.file_format
+        self.output_file = getattr(options, 'output_name', None) or self.input_file.split('.')[0]
+        self.formats = file_formats(options.file_format)
         self.fonts = [json.loads(f.replace("'", '"')) for f in options.fonts]
         self.replace_text = options.replace_text
         self.separator = options.separator
 
     def write_menu(self, recipes):
         template = self.open_template()
-        if any('ingredients' in r for r in self.options.replace_text['recipe_text']):
+        # batch workers have no API, their recipes arrive with details already loaded
+        if self.api and any('ingredients' in r for r in self.options.replace_text['recipe_text']):
             for r in recipes:
                 r.addDetails(self.api)
-        template = self.find_and_replace(recipes, template)
-        self.write_temp_template(template)
-        self.convert_svg()
-        self.cleanup()
-
-    def convert_svg(self):
-        # Register font files
-        for f in self.fonts:
-            self.logger.debug(f'Loading font {f["name"]} from {os.path.join(self.template_dir, f["file"])}.')
-            font = TTFont(f['name'], os.path.join(self.template_dir, f['file']))
-            pdfmetrics.registerFont(font)
-            self.logger.debug(f'Font {font.fontName} loaded succesfully.')
-
-        # Load the SVG file as a ReportLab graphics object
-        drawing = svg2rlg(self.temp_file)
-
-        temp_output = os.path.join(os.getcwd(), f'temp.{self.ext}')
-        if self.ext.lower() == 'pdf':
-            output_file = os.path.join(self.output_dir, f'{self.output_file}.{self.ext}')
-            self.logger.debug(f'Writing PDF to {output_file}.')
-            renderPDF.drawToFile(drawing, temp_output)
-        else:
-            output_file = os.path.join(self.output_dir, f'{self.output_file}.{self.ext}')
-            self.logger.debug(f'Writing {self.ext} to {output_file}.')
-            renderPM.drawToFile(drawing, temp_output, fmt=self.ext)
-        self.logger.debug(f'Moving file {temp_output} to {output_file}.')
-        os.rename(temp_output, output_file)
-        os.chmod(output_file, 0o755)
-        self.archive(output_file)
+        with tracer.span('find_and_replace', category='render'):
+            template = self.find_and_replace(recipes, template)
+        self.archive_text(template, target_name=f'{self.output_file}{os.path.splitext(self.input_file)[1]}')
+        register_fonts(self.fonts, self.template_dir, self.logger)
+        return self.convert_svg(template)
+
+    def load_drawing(self, template):
+        # parse the SVG from memory; relative references resolve against the template location
+        parser = etree.XMLParser(remove_comments=True, recover=True, resolve_entities=False)
+        svg = etree.fromstring(template.encode('utf-8'), parser=parser)
+        return SvgRenderer(os.path.join(self.template_dir, self.input_file)).render(svg)
+
+    def convert_svg(self, template):
+        with tracer.span('load_drawing', category='render'):
+            drawing = self.load_drawing(template)
+
+        # PDF is drawn from the vector graphics, every bitmap format shares a single rasterization
+        bitmaps = [ext for ext in self.formats if ext.lower() != 'pdf']
+        jobs = [(self.render_bitmaps, bitmaps)] if bitmaps else []
+        if len(bitmaps) < len(self.formats):
+            jobs.append((self.render_pdf, [ext for ext in self.formats if ext.lower() == 'pdf'][0]))
+
+        with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+            # rendering marks the drawing's nodes while it walks them, so each job renders its own
+            # copy, made before any of them starts
+            drawings = [drawing] + [deepcopy(drawing) for _ in jobs[1:]]
+            futures = [pool.submit(job, d, arg) for d, (job, arg) in zip(drawings, jobs)]
+            output_files = []
+            for f in futures:
+                output_files += f.result()
+
+        for output_file in output_files:
+            os.chmod(output_file, 0o755)
+            self.archive(output_file)
+        return output_files
+
+    def render_pdf(self, drawing, ext):
+        output_file = os.path.join(self.output_dir, f'{self.output_file}.{ext}')
+        self.logger.debug(f'Writing PDF to {output_file}.')
+        with tracer.span('render_pdf', category='render'):
+            renderPDF.drawToFile(drawing, output_file)
+        return [output_file]
+
+    def render_bitmaps(self, drawing, formats):
+        with tracer.span('rasterize', category='render'):
+            canvas = renderPM.drawToPMCanvas(drawing)
+        output_files = []
+        for ext in formats:
+            output_file = os.path.join(self.output_dir, f'{self.output_file}.{ext}')
+            self.logger.debug(f'Writing {ext} to {output_file}.')
+            with tracer.span(f'encode_{ext.lower()}', category='render'):
+                canvas.saveToFile(output_file, fmt=ext)
+            output_files.append(output_file)
+        return output_files
 
     def find_and_replace(self, recipes, template):
         def _escape_svg_text(text):
@@ -85,83 +274,70 @@ class MenuGenerator:
         replacement_dict = self.prepare_replacement(recipes)
 
         for k, v in replacement_dict.items():
-            self.api.update_progress()
+            if self.api:
+                self.api.update_progress()
             template = re.sub(re.escape(k), _escape_svg_text(v), template)
 
         return template
 
     def prepare_replacement(self, recipes):
         def _length_replace_ing(x):
-            return len(' '.join(x['ingredients']))
+            return len(' '.join(x.get('ingredients', [])))
 
         def _length_recipe_ing(x):
             return len(self.options.separator.join(x))
 
+        def _truncate_ingredients(slot_length, ingredients):
+            # keep adding ingredients until the slot is full, chunking trims the overflow
+            used = 0
+            count = 0
+            while count < len(ingredients) and slot_length > used:
+                used += len(ingredients[count]) + (len(self.options.separator) if count else 0)
+                count += 1
+            return ingredients[:count]
+
         def _chunk_ingredients(before, after):
             pairs = []
             separator = self.options.separator.replace(" ", "~|~")
-            after = f' {separator} '.join(after).split()
+            words = f' {separator} '.join(after).split()
+            idx = 0
             for x in before:
                 chunk = ''
-                while after and len(x) >= len(chunk + after[0]):
-                    next_chunk = after.pop(0)
+                while idx < len(words) and len(x) >= len(chunk) + len(words[idx]):
+                    next_chunk = words[idx]
+                    idx += 1
                     if chunk == '':
                         if next_chunk == separator:
-                            next_chunk = after.pop(0)
+                            next_chunk = words[idx]
+                            idx += 1
                         chunk += next_chunk
                     else:
                         chunk += (" " + next_chunk.replace('~|~', ' ')).replace("  ", " ")
-
-                if chunk:
-                    pairs.append((x, chunk))
-                else:
-                    pairs.append((x, ''))
+                pairs.append((x, chunk))
             return pairs
 
-        # create temporary array to assign before/after values
-        temp_text = []
-        for idx in range(len(self.options.replace_text['recipe_text'])):
-            before = dict(self.options.replace_text['recipe_text'][idx])
-            before['after_name'] = recipes[idx].name
-            before['after_ing'] = [ing.name for ing in recipes[idx].ingredients]
-            temp_text.append(before)
-
-        # confirm that all after strings are shorter than before strings.
-        for y in range(len(temp_text)):
-            text_fits = len(temp_text[y]['name']) >= len(temp_text[y]['after_name']) and _length_replace_ing(temp_text[y]) >= _length_recipe_ing(temp_text[y]['after_ing'])
-            if not text_fits:
-                truncate_text = True
-                # if there are no other slots that the name and ingredients fit - just truncate the text
-                if (
-                    any(len(t['name']) >= len(temp_text[y]['after_name']) for t in temp_text) and
-                    any(_length_replace_ing(t) >= _length_recipe_ing(temp_text[y]['after_ing']) for t in temp_text)
-                ):
-                    for z in range(len(temp_text)):
-                        # if swapping the recipes between two positions fits the text then do that
-                        if (
-                            len(temp_text[z]['name']) > len(temp_text[y]['after_name']) and _length_replace_ing(temp_text[z]) >= _length_recipe_ing(temp_text[y]['after_ing']) and
-                            len(temp_text[y]['name']) > len(temp_text[z]['after_name']) and _length_replace_ing(temp_text[y]) >= _length_recipe_ing(temp_text[z]['after_ing'])
-                        ):
-                            tmp_name = temp_text[y]['after_name']
-                            tmp_ing = temp_text[y]['after_ing']
-                            temp_text[y]['after_name'] = temp_text[z]['after_name']
-                            temp_text[y]['after_ing'] = temp_text[z]['after_ing']
-                            temp_text[z]['after_name'] = tmp_name
-                            temp_text[z]['after_ing'] = tmp_ing
-                            truncate_text = False
-                if truncate_text:
-                    temp_text[y]['after_name'] = temp_text[y]['after_name'][:len(temp_text[y]['name'])]
-                    new_ing = []
-                    while temp_text[y]['after_ing'] and _length_replace_ing(temp_text[y]) > _length_recipe_ing(new_ing):
-                        new_ing.append(temp_text[y]['after_ing'].pop(0))
-                    temp_text[y]['after_ing'] = new_ing
+        slots = [dict(x) for x in self.options.replace_text['recipe_text']]
+        recipe_text = [(r.name, [ing.name for ing in r.ingredients]) for r in recipes[:len(slots)]]
+        # slots without a recipe are blanked
+        recipe_text += [('', [])] * (len(slots) - len(recipe_text))
+
+        # cost of a recipe in a slot is the number of characters that would be truncated
+        # scaled so that keeping a recipe in its original slot only breaks ties
+        cost = []
+        for y, slot in enumerate(slots):
+            row = []
+            for z, (name, ingredients) in enumerate(recipe_text):
+                truncated = max(0, len(name) - len(slot['name'])) + max(0, _length_recipe_ing(ingredients) - _length_replace_ing(slot))
+                row.append(truncated * (len(slots) + 1) + (y != z))
+            cost.append(row)
 
         # create replacement dict in the form of key:value = before:after
         replacements = {}
-        for y in temp_text:
-            replacements[y['name']] = y['after_name']
-            after_chunks = _chunk_ingredients(y['ingredients'], y['after_ing'])
-            for pair in after_chunks:
+        for slot, z in zip(slots, assign_slots(cost)):
+            name, ingredients = recipe_text[z]
+            replacements[slot['name']] = name[:len(slot['name'])]
+            after_ing = _truncate_ingredients(_length_replace_ing(slot), ingredients)
+            for pair in _chunk_ingredients(slot.get('ingredients', []), after_ing):
                 replacements[pair[0]] = pair[1]
         return replacements
 
@@ -171,30 +347,29 @@ class MenuGenerator:
         with open(os.path.join(self.template_dir, self.input_file)) as f:
             return f.read()
 
-    def write_temp_template(self, template):
-        self.logger.debug(f'Writing temporary template to {self.temp_file}.')
-        with open(self.temp_file, 'w') as f:
-            f.write(template)
-
-    def cleanup(self):
-        self.archive(self.temp_file, target_name=self.input_file)
-        self.logger.debug(f'Removing temporary file {self.temp_file}.')
-        os.remove(self.temp_file)
+    def archive_path(self, target_name):
+        archive_dir = os.path.join(self.template_dir, 'archive')
+        if not os.path.exists(archive_dir):
+            os.makedirs(archive_dir)
+        filename, ext = os.path.splitext(os.path.basename(target_name))
+        archive_file = (a_file := f"{filename}-{(datetime.now().strftime('%y%m%d'))}")
+        count = 1
+        while os.path.exists(os.path.join(archive_dir, f"{archive_file}{ext}")):
+            archive_file = a_file + '_' + str(count)
+            count += 1
+        return os.path.join(archive_dir, f"{archive_file}{ext}")
 
     def archive(self, file, target_name=None):
         if not target_name:
             target_name = file
         if self.logger.loglevel == logging.DEBUG:
-            archive_dir = os.path.join(self.template_dir, 'archive')
-            if not os.path.exists(archive_dir):
-                os.makedirs(archive_dir)
-            filename, ext = os.path.splitext(os.path.basename(target_name))
-            archive_file = (a_file := f"{filename}-{(datetime.now().strftime('%y%m%d'))}")
-            count = 1
-            while os.path.exists(os.path.join(archive_dir, f"{archive_file}{ext}")):
-                archive_file = a_file + '_' + str(count)
-                count += 1
-            # os.rename(self.temp_file, os.path.join(archive_dir, "{archive_file}.{ext}"))
-            af = os.path.join(archive_dir, f"{archive_file}{ext}")
+            af = self.archive_path(target_name)
             self.logger.debug(f'Archiving file {file} to {af}.')
             copy2(file, af)
+
+    def archive_text(self, text, target_name):
+        if self.logger.loglevel == logging.DEBUG:
+            af = self.archive_path(target_name)
+            self.logger.debug(f'Archiving generated template to {af}.')
+            with open(af, 'w') as f:
+                f.write(text)
@@ -43,6 +43,16 @@ class Recipe(SetEnabledObjects):
         self.rating = json_recipe['rating']
         self.ingredients = []  # List of Ingredient objects5
 
+    @classmethod
+    def from_fields(cls, **fields):
+        '''
+        builds a Recipe from values that are already converted, e.g. read from a snapshot
+        '''
+        recipe = cls.__new__(cls)
+        recipe.__dict__.update(fields)
+        recipe.ingredients = []
+        return recipe
+
     @staticmethod
     def recipesWithKeyword(recipes, keywords):
         '''
@@ -91,6 +101,7 @@ class Recipe(SetEnabledObjects):
 
     def addDetails(self, api):
         recipe = api.get_recipe_details(self.id)
+        self.ingredients = []
         for f in [i['food'] for s in recipe['steps'] for i in s['ingredients']]:
             if not f['food_onhand']:
                 onhand_substitutes = api.get_food_substitutes(f['id'], substitute='food')
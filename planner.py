@@ -0,0 +1,101 @@
+import math
+from datetime import timedelta
+
+from utils import format_date, str2bool
+
+# date modifiers a constraint of each kind can have on top of its condition
+MODIFIERS = {
+    'keyword': ('cooked', 'created'),
+    'rating': ('cooked', 'created'),
+    'cookedon': ('created',),
+    'createdon': ('cookedon',),
+}
+
+
+def polarity(constraint, choices):
+    '''
+    constraint: constraint dict with count, operator and optional exclude
+    choices: number of recipes to choose
+
+    Returns:
+        True if every chosen recipe must match the condition, False if none may, None if it doesn't restrict the pool
+    '''
+    count, operator = constraint['count'], constraint['operator']
+    if operator in ('>=', '==') and count >= choices:
+        must = True
+    elif operator in ('<=', '==') and count == 0:
+        must = False
+    else:
+        return None
+    # an excluded constraint counts the recipes that don't match
+    return must != str2bool(constraint.get('exclude', False))
+
+
+def _date_param(date, after, inside):
+    '''
+    search parameter for cookedon or createdon that returns at least the wanted recipes
+    inside: the recipes on the after/before side of date are wanted, otherwise the other side
+
+    the server compares days in its own time zone, so a day of margin keeps the result a superset
+    '''
+    if after == inside:
+        return (date - timedelta(days=1)).strftime('%Y-%m-%d')
+    return '-' + (date + timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+def plan_pushdown(constraints, choices, logger):
+    '''
+    finds recipe search parameters that every chosen recipe has to match anyway, so only those
+    candidates are fetched instead of the whole library
+    constraints: dict of constraint kind to the list of its constraints, before they are prepared
+    choices: number of recipes to choose
+
+    a predicate is only pushed when the server's result is a superset of the recipes that can be
+    chosen; constraints are still evaluated locally on the smaller pool, so the menus that can be
+    chosen are the same as without pushdown
+
+    Returns:
+        dict of recipe search parameters, empty if nothing can be pushed down
+    '''
+    params = {}
+
+    def _push(param, value, kind, constraint):
+        if param in params:
+            logger.debug(f'Not pushing down {kind} constraint {constraint}, {param} is already used.')
+            return
+        params[param] = value
+        logger.debug(f'Pushing down {kind} constraint {constraint} as {param}={value}.')
+
+    for kind in ('keyword', 'rating', 'cookedon', 'createdon'):
+        for c in constraints.get(kind, []):
+            if (inside := polarity(c, choices)) is None:
+                continue
+            # with date modifiers the condition is only part of what is counted; it can be
+            # required of every recipe, but not matching it can't be required
+            if not inside and any(c.get(m) for m in MODIFIERS[kind]):
+                continue
+
+            if kind == 'keyword':
+                ids = [int(k) for k in (c['condition'] if isinstance(c['condition'], list) else [c['condition']])]
+                if inside:
+                    _push('keywords_or', ids, kind, c)
+                else:
+                    params['keywords_or_not'] = params.get('keywords_or_not', []) + ids
+                    logger.debug(f'Pushing down {kind} constraint {c} as keywords_or_not={ids}.')
+            elif kind == 'rating':
+                # recipes below or without a rating are wanted when none may match; the server can't return unrated recipes
+                rating = float(c['condition'])
+                if not inside or rating == 0:
+                    continue
+                if rating > 0:
+                    if math.floor(rating) >= 1:
+                        _push('rating', math.floor(rating), kind, c)
+                else:
+                    _push('rating', -(math.floor(abs(rating)) + 1), kind, c)
+            else:
+                date, after = format_date(c['condition'])
+                # never cooked recipes are wanted when none may match, the server doesn't return them for a date
+                if kind == 'cookedon' and not inside:
+                    continue
+                _push(kind, _date_param(date, after, inside), kind, c)
+    return params
@@ -0,0 +1,187 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+NULL_STAGE = nullcontext()
+
+
+class StackSampler:
+    '''
+    samples the stack of the thread running a stage at a fixed interval and counts the
+    collapsed stacks, the input format of flamegraph.pl, speedscope and inferno
+    '''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self.current = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='StackSampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.interval)
+            if not (current := self.current):
+                continue
+            thread_id, stage = current
+            if (frame := sys._current_frames().get(thread_id)) is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.counts[';'.join([stage] + stack[::-1])] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.counts.items()))
+
+
+class Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.engine = None
+
+    def __enter__(self):
+        if self.profiler.active:
+            # stages don't nest, the outer stage keeps the time
+            self.engine = None
+            return self
+        self.profiler.active = self.name
+        self.engine = self.profiler.engine(self.name)
+        self.profiler.sampler.current = (threading.get_ident(), self.name)
+        self.engine.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.engine is not None:
+            self.engine.stop()
+            self.profiler.sampler.current = None
+            self.profiler.active = None
+        return False
+
+
+class CProfileEngine:
+    suffix = 'prof'
+
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+    def summary(self, top):
+        import io
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(top)
+        return out.getvalue()
+
+
+class PyinstrumentEngine:
+    suffix = 'html'
+
+    def __init__(self):
+        from pyinstrument import Profiler
+        self.profile = Profiler()
+
+    def start(self):
+        self.profile.start()
+
+    def stop(self):
+        self.profile.stop()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write(self.profile.output_html())
+
+    def summary(self, top):
+        return self.profile.output_text()
+
+
+class Profiler:
+    '''
+    profiles each stage of a run into its own file; pyinstrument is used when it is installed,
+    cProfile otherwise.  While disabled, stage() returns a shared no-op context manager.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self.engines = {}
+        self.active = None
+        self.sampler = StackSampler()
+        self.engine_class = CProfileEngine
+
+    def enable(self, directory, interval=0.005):
+        try:
+            import pyinstrument  # noqa: F401
+            self.engine_class = PyinstrumentEngine
+        except ImportError:
+            self.engine_class = CProfileEngine
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sampler.interval = interval
+        self.sampler.start()
+        self.enabled = True
+
+    def reset(self):
+        self.engines = {}
+        self.sampler.counts = Counter()
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def engine(self, name):
+        if name not in self.engines:
+            self.engines[name] = self.engine_class()
+        return self.engines[name]
+
+    def export(self, summary=True, top=15):
+        '''
+        writes <stage>.prof (cProfile, open with snakeviz or pstats) or <stage>.html (pyinstrument)
+        for every stage and stacks.collapsed for flamegraphs to the profile directory
+        '''
+        if not self.enabled:
+            return
+        for name, engine in self.engines.items():
+            engine.write(os.path.join(self.directory, f'{name}.{engine.suffix}'))
+            if summary:
+                print(f'\nProfile of stage {name}:\n{engine.summary(top)}', file=sys.stderr)
+        with open(os.path.join(self.directory, 'stacks.collapsed'), 'w') as f:
+            f.write(self.sampler.collapsed())
+        if summary:
+            print(f'Profiles of {len(self.engines)} stages written to {self.directory}', file=sys.stderr)
+
+    def close(self):
+        # in server mode the last request was already exported
+        if self.engines:
+            self.export()
+        self.sampler.stop()
+
+
+profiler = Profiler()
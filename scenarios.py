@@ -0,0 +1,175 @@
+import copy
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from create_menu import Menu
+from utils import init_worker_logging, log_queue
+
+CONSTRAINTS = ('keyword', 'food', 'book', 'rating', 'cookedon', 'createdon')
+
+
+def load_scenarios(path):
+    '''
+    reads a YAML file of constraint variants
+    path: file with a list of variants, or a mapping with 'variants' and/or 'grid'
+
+    a variant overrides options of the config, e.g. {'name': 'strict', 'choices': 7, 'keyword': [...]};
+    a grid maps an option, or a field of one constraint as kind.index.field, to the values to try and
+    every combination is a scenario.  With both, the grid is applied to every variant.
+
+    Returns:
+        list of (name, overrides)
+    '''
+    import yaml
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    if isinstance(data, list):
+        data = {'variants': data}
+    variants = [dict(v) for v in data.get('variants', [])] or [{'name': 'base'}]
+    grid = data.get('grid', {})
+    keys = list(grid)
+    scenarios = []
+    for n, variant in enumerate(variants, start=1):
+        named = 'name' in variant or len(variants) > 1
+        name = str(variant.pop('name', f'variant {n}'))
+        for values in itertools.product(*(_as_values(grid[k]) for k in keys)):
+            overrides = dict(variant)
+            overrides.update(zip(keys, values))
+            label = ', '.join(f'{k}={v}' for k, v in zip(keys, values))
+            if label and named:
+                label = f'{name}: {label}'
+            scenarios.append((label or name, overrides))
+    return scenarios
+
+
+def _as_values(value):
+    return value if isinstance(value, list) else [value]
+
+
+def apply_overrides(args, overrides):
+    '''
+    Returns:
+        copy of the parsed options with the overrides applied
+    '''
+    args = copy.copy(args)
+    constraints = {c: [json.loads(x.replace("'", '"')) for x in getattr(args, c, [])] for c in CONSTRAINTS}
+    for key, value in overrides.items():
+        kind, _, field = str(key).partition('.')
+        if kind in CONSTRAINTS and field:
+            index, _, field = field.partition('.')
+            try:
+                constraints[kind][int(index)][field] = value
+            except (IndexError, ValueError):
+                raise ValueError(f'{key} does not name a field of one of the {kind} constraints')
+        elif kind in CONSTRAINTS:
+            constraints[kind] = _as_values(value)
+        elif hasattr(args, key):
+            setattr(args, key, value)
+        else:
+            raise ValueError(f'Unknown option {key}')
+    for kind, values in constraints.items():
+        setattr(args, kind, [json.dumps(v, default=str) for v in values])
+    return args
+
+
+def solve_scenario(recipes, numrecipes, specs, log, sample=0):
+    '''
+    solves one scenario in a worker process
+
+    Returns:
+        (feasible, seconds, ids of the chosen recipes)
+    '''
+    from solver import solve_specs
+    start = time.perf_counter()
+    try:
+        # an infeasible variant is a result shown in the report, not a problem to warn about
+        ids = solve_specs(recipes, numrecipes, specs, log, sample, report=False)
+    except RuntimeError:
+        return False, time.perf_counter() - start, []
+    return True, time.perf_counter() - start, ids
+
+
+class Scenario:
+    '''
+    one variant of the constraints and what solving it found
+    '''
+
+    def __init__(self, name, overrides):
+        self.name = name
+        self.overrides = overrides
+        self.menu = None
+        self.specs = []
+        self.matches = []
+        self.feasible = None
+        self.seconds = None
+        self.recipes = []
+        self.error = None
+
+
+class ScenarioExplorer:
+    '''
+    solves many variants of a config's constraints: the recipe pool, hierarchies and API responses
+    are loaded once and shared, and the solves run in parallel in a process pool
+    '''
+
+    def __init__(self, menu, scenarios, logger, workers=None):
+        self.menu = menu
+        self.scenarios = [Scenario(name, overrides) for name, overrides in scenarios]
+        self.logger = logger
+        self.workers = workers
+
+    def prepare(self):
+        # the variants change the constraints, so the shared pool can't be narrowed by them
+        self.menu._pushdown = {}
+        self.menu.prepare_data()
+        for scenario in self.scenarios:
+            try:
+                args = apply_overrides(self.menu.options, scenario.overrides)
+                menu = Menu(args, tandoor=self.menu.tandoor, logger=self.logger, recipes=self.menu.recipes)
+                menu._keywords, menu._foods = self.menu._keywords, self.menu._foods
+                menu.prepare_data()
+                specs = menu.constraint_specs()
+            except Exception as e:
+                scenario.error = str(e)
+                self.logger.warning(f'Scenario {scenario.name} failed to prepare: {e}')
+                continue
+            pool = {r.id for r in menu.recipes}
+            for kind, found, count, operator, exclude in specs:
+                matching = len(pool & {r.id for r in found})
+                scenario.matches.append((f'{"not " if exclude else ""}{kind} {operator} {count}', len(pool) - matching if exclude else matching))
+            scenario.menu = menu
+            scenario.specs = specs
+
+    def solve(self):
+        scenarios = [s for s in self.scenarios if s.error is None]
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker_logging, initargs=(log_queue(), self.logger.level)) as executor:
+            futures = [
+                executor.submit(solve_scenario, s.menu.recipes, s.menu.choices, s.specs, self.logger.loglevel, s.menu.options.sample_pool)
+                for s in scenarios
+            ]
+            for scenario, future in zip(scenarios, futures):
+                try:
+                    scenario.feasible, scenario.seconds, ids = future.result()
+                    scenario.recipes = [r for r in scenario.menu.recipes if r.id in set(ids)]
+                except Exception as e:
+                    scenario.error = str(e)
+
+    def report(self):
+        width = max([len(s.name) for s in self.scenarios] + [8])
+        lines = [f'{"Scenario":<{width}}  Feasible  Solve    Matching recipes']
+        for s in self.scenarios:
+            if s.error:
+                lines.append(f'{s.name:<{width}}  error     -        {s.error}')
+                continue
+            matches = ', '.join(f'{label}: {count}' for label, count in s.matches) or '-'
+            lines.append(f'{s.name:<{width}}  {"yes" if s.feasible else "no":<8}  {s.seconds:>5.2f}s   {matches}')
+        return '\n'.join(lines)
+
+    def run(self):
+        start = time.perf_counter()
+        self.prepare()
+        self.solve()
+        self.logger.info(f'Explored {len(self.scenarios)} scenarios in {time.perf_counter() - start:.1f} seconds.')
+        return self.scenarios
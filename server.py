@@ -0,0 +1,232 @@
+import json
+import os
+import socketserver
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from create_menu import Menu, parse_args, validate_args
+from profiling import profiler
+from tandoor_api import TandoorAPI
+from tracing import tracer
+from utils import setup_logging
+
+# options a request may set; everything else, such as paths, the Tandoor server and the cache,
+# comes from the config the server was started with
+REQUEST_OPTIONS = {
+    'recipes', 'filters', 'plan_type', 'plan_from', 'plan_to', 'choices', 'sample_pool',
+    'book', 'food', 'keyword', 'rating', 'cookedon', 'createdon', 'food_index', 'pushdown', 'include_children',
+    'create_mp', 'share_with', 'mp_date', 'mp_type', 'mp_note', 'cleanup_mp', 'cleanup_date',
+    'create_file', 'file_format', 'replace_text', 'separator'
+}
+
+
+class InvalidRequest(Exception):
+    pass
+
+
+def server_argv(argv):
+    '''
+    Returns:
+        the command line the server was started with, without --serve and its address
+    '''
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+            if not arg.startswith('-'):
+                continue
+        if arg == '--serve':
+            skip = True
+        elif not arg.startswith('--serve='):
+            result.append(arg)
+    return result
+
+
+class MenuServer:
+    '''
+    keeps the interpreter, imports, cache, fonts, HTTP connections and recipe pools warm
+    between menu requests
+    '''
+
+    def __init__(self, args, argv=None):
+        self.args = args
+        # options the server was started with apply to every request, the request's options come after them
+        self.argv = server_argv(argv) if argv is not None else ['-c', self.args.my_config]
+        self.logger = setup_logging(log=args.log, file_level=args.log_file_level)
+        self.apis = {}
+        self.pools = {}
+
+    def options_to_argv(self, options):
+        argv = list(self.argv)
+        for key, value in options.items():
+            flag = f'--{key}'
+            if isinstance(value, bool):
+                if value:
+                    argv.append(flag)
+            elif isinstance(value, list):
+                argv += [flag] + [json.dumps(x) if isinstance(x, (dict, list)) else str(x) for x in value]
+            elif isinstance(value, dict):
+                argv.append(f'{flag}={json.dumps(value)}')
+            elif value is not None:
+                # one argument, so values like -7days aren't taken for a flag
+                argv.append(f'{flag}={value}')
+        return argv
+
+    def get_api(self, options):
+        key = (options.url, options.token)
+        if key not in self.apis:
+            self.apis[key] = TandoorAPI(
+                options.url, options.token, self.logger, cache=int(options.cache), progress=False, cache_policy=options.cache_policy, cache_backend=options.cache_backend,
+                retries=options.retries, rate_limit=options.rate_limit, rate_burst=options.rate_burst
+            )
+        api = self.apis[key]
+        api.ttl = int(options.cache)
+        api.policies = options.cache_policy or {}
+        api.cache_backend = options.cache_backend
+        return api
+
+    def get_pool(self, options, pushdown=None):
+        ttl = int(options.cache)
+        key = json.dumps([options.url, options.recipes, options.filters, options.plan_type, options.mp_date.strftime('%Y-%m-%d'), [d and d.strftime('%Y-%m-%d') for d in (options.plan_from, options.plan_to)], pushdown or {}], sort_keys=True, default=str)
+        if ttl <= 0:
+            return key, None
+        expires, recipes = self.pools.get(key, (None, None))
+        if expires and expires > datetime.now():
+            return key, recipes
+        return key, None
+
+    def handle(self, options):
+        start = time.perf_counter()
+        try:
+            return self.run(options, start)
+        finally:
+            # every request replaces the trace and metrics files of the previous one
+            if tracer.enabled:
+                tracer.export(trace_file=self.args.trace_file, metrics_file=self.args.metrics_file)
+                tracer.reset()
+            if profiler.enabled:
+                profiler.export(summary=False)
+                profiler.reset()
+
+    def parse(self, options):
+        '''
+        Returns:
+            the options of a request, parsed and validated like the command line
+        '''
+        try:
+            args = parse_args(self.options_to_argv(options))
+            validate_args(args)
+        except (ValueError, RuntimeError) as e:
+            raise InvalidRequest(str(e))
+        return args
+
+    def run(self, options, start):
+        args = self.parse(options)
+        api = self.get_api(args)
+        # responses are only shared within a request, the cache decides what outlives it
+        api.reset_memo()
+        try:
+            menu = Menu(args, tandoor=api, logger=self.logger)
+        except (ValueError, RuntimeError) as e:
+            # the constraints and numbers are checked when the menu reads them
+            raise InvalidRequest(str(e))
+        # a snapshot is already mapped in memory, keeping its pool would only hide a newer export
+        key, pool = (None, None) if menu.snapshot else self.get_pool(args, menu.pushdown_params())
+        menu.recipe_pool = pool
+        menu.prepare_data()
+        if key and pool is None and int(args.cache) > 0:
+            self.pools[key] = (datetime.now() + timedelta(minutes=int(args.cache)), list(menu.recipes))
+
+        if len(menu.recipes) < menu.choices:
+            raise RuntimeError(f'Not enough recipes to generate a menu.  Only {len(menu.recipes)} recipes to work with.')
+        recipes = menu.select_recipes()
+        if args.create_mp:
+            menu.create_meal_plans(recipes)
+        if args.create_file:
+            menu.generate_menu_file(recipes)
+
+        return {
+            'recipes': [
+                {'id': r.id, 'name': r.name, 'url': f'{menu.tandoor.url.replace("/api/", "/view/recipe/")}{r.id}'}
+                for r in recipes
+            ],
+            'pool_size': len(menu.recipes),
+            'elapsed': round(time.perf_counter() - start, 3)
+        }
+
+
+class MenuRequestHandler(BaseHTTPRequestHandler):
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, {'status': 'ok'})
+        else:
+            self._send(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/menu':
+            self._send(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            options = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self._send(400, {'error': f'Invalid request body: {e}'})
+            return
+        if not isinstance(options, dict):
+            self._send(400, {'error': 'The request body must be a JSON object of options.'})
+            return
+        if unknown := sorted(set(options) - REQUEST_OPTIONS):
+            self._send(400, {'error': f'Options not allowed in requests: {", ".join(unknown)}'})
+            return
+        try:
+            self._send(200, self.server.menu_server.handle(options))
+        except SystemExit:
+            # argparse exits on invalid options
+            self._send(400, {'error': 'Invalid menu options.'})
+        except InvalidRequest as e:
+            self._send(400, {'error': f'Invalid menu options: {e}'})
+        except Exception as e:
+            self.server.menu_server.logger.warning(f'Menu request failed: {e}')
+            self._send(500, {'error': str(e)})
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        self.server.menu_server.logger.debug(f'{self.address_string()} {format % args}')
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    pass
+
+
+def serve(args, argv=None):
+    menu_server = MenuServer(args, argv)
+    if ':' in args.serve and os.sep not in args.serve:
+        host, port = args.serve.rsplit(':', 1)
+        httpd = HTTPServer((host, int(port)), MenuRequestHandler)
+    else:
+        if os.path.exists(args.serve):
+            os.remove(args.serve)
+        httpd = UnixHTTPServer(args.serve, MenuRequestHandler)
+    httpd.menu_server = menu_server
+    menu_server.logger.info(f'Serving menu requests on {args.serve}.')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if isinstance(httpd, UnixHTTPServer):
+            os.remove(args.serve)
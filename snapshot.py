@@ -0,0 +1,297 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+MAGIC = b'TMSNAP\x00\x00'
+VERSION = 1
+# magic, format version, reserved, length of the table of contents
+HEADER = struct.Struct('<8sHHI')
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# stands for a missing date, servings or rating offset
+MISSING = -2 ** 31
+MISSING_DATE = -2 ** 63
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _align(n):
+    return n + (-n % 8)
+
+
+def _timestamp(date):
+    '''
+    Returns:
+        (microseconds since the epoch, utc offset in seconds or MISSING for a naive date)
+    '''
+    if date is None:
+        return MISSING_DATE, MISSING
+    if date.tzinfo is None:
+        return (date.replace(tzinfo=timezone.utc) - EPOCH) // timedelta(microseconds=1), MISSING
+    return (date - EPOCH) // timedelta(microseconds=1), int(date.utcoffset().total_seconds())
+
+
+def _date(microseconds, offset):
+    if microseconds == MISSING_DATE:
+        return None
+    date = EPOCH + timedelta(microseconds=microseconds)
+    if offset == MISSING:
+        return date.replace(tzinfo=None)
+    return date.astimezone(timezone(timedelta(seconds=offset)))
+
+
+class _Writer:
+    def __init__(self):
+        self.parts = []
+        self.sections = {}
+        self.size = 0
+
+    def add(self, name, typecode, values):
+        data = array(typecode, values).tobytes()
+        # every section starts 8 byte aligned so it can be cast in place
+        padding = -self.size % 8
+        self.parts.append(b'\x00' * padding + data)
+        self.size += padding
+        self.sections[name] = [self.size, len(data) // array(typecode).itemsize, typecode]
+        self.size += len(data)
+
+    def add_table(self, name, ids, members, objects):
+        '''
+        ids: list of ids; members: function(id) -> ids; objects: function(id) -> dict or None
+        '''
+        ids = sorted(ids)
+        offsets, flat, object_offsets, blob = [0], [], [0], bytearray()
+        for node_id in ids:
+            flat += sorted(members(node_id))
+            offsets.append(len(flat))
+            if (obj := objects(node_id)) is not None:
+                blob += json.dumps(obj, separators=(',', ':')).encode('utf-8')
+            object_offsets.append(len(blob))
+        self.add(f'{name}.ids', 'q', ids)
+        self.add(f'{name}.offsets', 'q', offsets)
+        self.add(f'{name}.members', 'q', flat)
+        self.add(f'{name}.object_offsets', 'q', object_offsets)
+        self.add(f'{name}.objects', 'B', blob)
+
+    def add_strings(self, name, strings):
+        offsets, blob = [0], bytearray()
+        for s in strings:
+            blob += (s or '').encode('utf-8')
+            offsets.append(len(blob))
+        self.add(f'{name}.offsets', 'q', offsets)
+        self.add(name, 'B', blob)
+
+
+def write_snapshot(path, recipes, keywords=None, foods=None, books=None, memberships=None, postings=None, meal_types=None, source=None):
+    '''
+    writes everything a run needs to one binary file that workers can map read-only
+    path: file to write, replaced atomically so running workers keep the snapshot they opened
+    recipes: list of Recipes in the pool
+    keywords, foods: Hierarchy of keywords and foods
+    books: dict of book id to the book in tandoor format
+    memberships: dict of book id to the set of ids of its recipes
+    postings: dict of food id to the set of ids of recipes using it, None when foods aren't indexed
+    meal_types: dict of meal type id to the meal type in tandoor format
+    '''
+    writer = _Writer()
+    recipes = sorted(recipes, key=lambda r: r.id)
+    created = [_timestamp(r.createdon) for r in recipes]
+    cooked = [_timestamp(r.cookedon) for r in recipes]
+    writer.add('recipe.ids', 'q', [r.id for r in recipes])
+    writer.add('recipe.created', 'q', [c[0] for c in created])
+    writer.add('recipe.created_offset', 'i', [c[1] for c in created])
+    writer.add('recipe.cooked', 'q', [c[0] for c in cooked])
+    writer.add('recipe.cooked_offset', 'i', [c[1] for c in cooked])
+    writer.add('recipe.rating', 'd', [float('nan') if r.rating is None else r.rating for r in recipes])
+    writer.add('recipe.servings', 'i', [MISSING if r.servings is None else r.servings for r in recipes])
+    writer.add('recipe.new', 'B', [bool(r.new) for r in recipes])
+    writer.add_strings('recipe.name', [r.name for r in recipes])
+    writer.add_strings('recipe.description', [r.description for r in recipes])
+    keyword_offsets, keyword_ids = [0], []
+    for r in recipes:
+        keyword_ids += r.keywords
+        keyword_offsets.append(len(keyword_ids))
+    writer.add('recipe.keyword_offsets', 'q', keyword_offsets)
+    writer.add('recipe.keywords', 'q', keyword_ids)
+
+    for name, tree in (('keyword', keywords), ('food', foods)):
+        if tree is not None:
+            writer.add_table(name, tree.nodes, tree.descendant_ids, tree.node)
+    memberships = memberships or {}
+    books = books or {}
+    writer.add_table('book', [int(bk) for bk in memberships], lambda bk: memberships.get(bk, memberships.get(str(bk), ())), lambda bk: books.get(bk, books.get(str(bk))))
+    if postings is not None:
+        writer.add_table('postings', postings, postings.get, lambda _: None)
+    meal_types = meal_types or {}
+    writer.add_table('meal_type', [int(mt) for mt in meal_types], lambda _: (), lambda mt: meal_types.get(mt, meal_types.get(str(mt))))
+
+    toc = json.dumps({
+        'byteorder': sys.byteorder, 'source': source, 'created': datetime.now(timezone.utc).isoformat(),
+        'recipes': len(recipes), 'sections': writer.sections
+    }).encode('utf-8')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(toc)))
+        f.write(toc)
+        f.write(b'\x00' * (_align(HEADER.size + len(toc)) - HEADER.size - len(toc)))
+        for part in writer.parts:
+            f.write(part)
+    os.replace(tmp, path)
+
+
+class SnapshotTable:
+    '''
+    sorted ids, each with a list of member ids and an object in tandoor format, read from the mapped file
+    '''
+
+    def __init__(self, snapshot, name):
+        self.ids = snapshot.array(f'{name}.ids')
+        self.offsets = snapshot.array(f'{name}.offsets')
+        self.members = snapshot.array(f'{name}.members')
+        self.object_offsets = snapshot.array(f'{name}.object_offsets')
+        self.objects = snapshot.array(f'{name}.objects')
+
+    def _index(self, node_id):
+        try:
+            node_id = int(node_id)
+        except (TypeError, ValueError):
+            return None
+        i = bisect_left(self.ids, node_id)
+        return i if i < len(self.ids) and self.ids[i] == node_id else None
+
+    def _find(self, node_id):
+        if (i := self._index(node_id)) is None:
+            raise KeyError(node_id)
+        return i
+
+    def __contains__(self, node_id):
+        return self._index(node_id) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def member_ids(self, node_id):
+        i = self._find(node_id)
+        return set(self.members[self.offsets[i]:self.offsets[i + 1]])
+
+    def object(self, node_id):
+        i = self._find(node_id)
+        return json.loads(bytes(self.objects[self.object_offsets[i]:self.object_offsets[i + 1]]))
+
+
+class SnapshotHierarchy(SnapshotTable):
+    '''
+    the closure table of a keyword or food tree, answers like hierarchy.Hierarchy
+    '''
+
+    def node(self, node_id):
+        return self.object(node_id)
+
+    def descendant_ids(self, node_id):
+        return self.member_ids(node_id)
+
+    def descendants(self, node_id):
+        return [self.object(i) for i in self.member_ids(node_id)]
+
+
+class Snapshot:
+    '''
+    read-only view of a snapshot file written by write_snapshot
+    path: snapshot file
+
+    the file is memory mapped, so processes reading the same snapshot share its pages; arrays are
+    used in place and only the recipes and objects that are asked for are decoded
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < HEADER.size:
+            raise SnapshotError(f'{path} is not a menu snapshot.')
+        magic, version, _, toc_length = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f'{path} is not a menu snapshot.')
+        if version != VERSION:
+            raise SnapshotError(f'{path} is a version {version} snapshot, this version reads version {VERSION}; export it again.')
+        self.toc = json.loads(self.mm[HEADER.size:HEADER.size + toc_length])
+        if self.toc['byteorder'] != sys.byteorder:
+            raise SnapshotError(f'{path} was written on a {self.toc["byteorder"]} endian machine; export it again.')
+        self.base = _align(HEADER.size + toc_length)
+        self.view = memoryview(self.mm)
+        self._tables = {}
+
+    def array(self, name):
+        offset, count, typecode = self.toc['sections'][name]
+        start = self.base + offset
+        return self.view[start:start + count * array(typecode).itemsize].cast(typecode)
+
+    def has(self, name):
+        return f'{name}.ids' in self.toc['sections']
+
+    def table(self, name, cls=SnapshotTable):
+        if name not in self._tables:
+            if not self.has(name):
+                raise SnapshotError(f'{self.path} has no {name} data; export it with a config that needs it.')
+            self._tables[name] = cls(self, name)
+        return self._tables[name]
+
+    def _strings(self, name):
+        offsets, blob = self.array(f'{name}.offsets'), self.array(name)
+        return [bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in range(len(offsets) - 1)]
+
+    def recipes(self):
+        '''
+        Returns:
+            list of Recipes in the pool
+        '''
+        from models import Recipe
+        ids = self.array('recipe.ids')
+        created, created_offset = self.array('recipe.created'), self.array('recipe.created_offset')
+        cooked, cooked_offset = self.array('recipe.cooked'), self.array('recipe.cooked_offset')
+        rating, servings, new = self.array('recipe.rating'), self.array('recipe.servings'), self.array('recipe.new')
+        keyword_offsets, keywords = self.array('recipe.keyword_offsets'), self.array('recipe.keywords')
+        names, descriptions = self._strings('recipe.name'), self._strings('recipe.description')
+        return [
+            Recipe.from_fields(
+                id=ids[i], name=names[i], description=descriptions[i], new=bool(new[i]),
+                servings=None if servings[i] == MISSING else servings[i],
+                keywords=list(keywords[keyword_offsets[i]:keyword_offsets[i + 1]]),
+                cookedon=_date(cooked[i], cooked_offset[i]), createdon=_date(created[i], created_offset[i]),
+                rating=None if rating[i] != rating[i] else rating[i]
+            )
+            for i in range(len(ids))
+        ]
+
+    def hierarchy(self, kind):
+        return self.table(kind, SnapshotHierarchy)
+
+    def book(self, book_id):
+        return self.table('book').object(book_id)
+
+    def book_recipes(self, book_id):
+        if book_id not in (table := self.table('book')):
+            raise SnapshotError(f'{self.path} has no book {book_id}; export it with a config that uses it.')
+        return table.member_ids(book_id)
+
+    def recipes_with(self, food_ids):
+        '''
+        Returns:
+            set of ids of the recipes that use any of the foods, like FoodIndex.recipes_with
+        '''
+        postings = self.table('postings')
+        found = set()
+        for food in food_ids:
+            if food in postings:
+                found |= postings.member_ids(food)
+        return found
+
+    def meal_types(self):
+        table = self.table('meal_type')
+        return {mt: table.object(mt) for mt in table.ids}
@@ -1,9 +1,12 @@
 import logging
 import random
+from collections import defaultdict
 
 from pulp import LpMaximize, LpProblem, LpVariable, lpSum, value
 from pulp.apis import PULP_CBC_CMD
 
+from tracing import tracer
+
 VALID_OPERATORS = (">=", "<=", "==")
 
 
@@ -49,7 +52,7 @@ class RecipePicker:
         elif operator == "==":
             self.model += recipe_sum == numrecipes
 
-        self.logger.debug(f'Added {description} constraint {operator} {numrecipes}. Found {len(found_recipes)} matching recipes.')
+        self.logger.debug('Added %s constraint %s %s. Found %d matching recipes.', description, operator, numrecipes, len(found_recipes))
         self.numcriteria += 1
 
     def add_food_constraint(self, found_recipes, numrecipes, operator, exclude=False):
@@ -70,13 +73,130 @@ class RecipePicker:
     def add_cookedon_constraints(self, found_recipes, numrecipes, operator, exclude=False):
         self._add_constraint(found_recipes, numrecipes, operator, exclude=exclude, description='cookedon')
 
-    def solve(self):
-        self.logger.debug(f'Solving to choose {self.numrecipes} with {self.numcriteria} unique criteria.')
+    def add_constraint(self, kind, found_recipes, numrecipes, operator, exclude=False):
+        self._add_constraint(found_recipes, numrecipes, operator, exclude=exclude, description=kind)
+
+    def solve(self, report=True):
+        '''
+        report: log that the criteria need adjusting when there is no solution
+        '''
+        self.logger.debug('Solving to choose %s with %s unique criteria.', self.numrecipes, self.numcriteria)
         debug = self.logger.loglevel == logging.DEBUG
-        self.model.solve(PULP_CBC_CMD(msg=debug))
+        with tracer.span('solve', pool=len(self.recipes), criteria=self.numcriteria) as span:
+            self.model.solve(PULP_CBC_CMD(msg=debug))
+            span.set(status=self.model.status)
         if self.model.status != 1:
+            if not report:
+                raise RuntimeError('No solution found.')
             self.logger.info('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
             self.logger.info('No solution found, adjustment of criteria required.')
             self.logger.info('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
             raise RuntimeError('No solution found.')
         return [r for r in self.recipes if value(self.recipe_vars[r.id]) >= 0.5]
+
+
+def _usable(signature, specs, numrecipes):
+    '''
+    Returns:
+        most recipes with this constraint signature any menu can contain
+    '''
+    usable = numrecipes
+    for matched, (_, _, count, operator, exclude) in zip(signature, specs):
+        # an excluded constraint counts the recipes that don't match
+        if matched != bool(exclude) and operator in ('<=', '=='):
+            usable = min(usable, int(count))
+    return max(usable, 0)
+
+
+def _allocate(sizes, minimums, total):
+    '''
+    splits total between groups in proportion to their sizes, giving each group at least its minimum
+    sizes, minimums: dicts of group to number of recipes
+
+    Returns:
+        dict of group to number of recipes to take, never more than the group has
+    '''
+    fixed = {}
+    while True:
+        free = [g for g in sizes if g not in fixed]
+        budget = max(total - sum(fixed.values()), 0)
+        weight = sum(sizes[g] for g in free)
+        shares = {g: budget * sizes[g] / weight for g in free}
+        below = [g for g in free if shares[g] < minimums[g]]
+        if not below:
+            break
+        fixed.update((g, minimums[g]) for g in below)
+    counts = dict(fixed)
+    counts.update((g, min(int(share), sizes[g])) for g, share in shares.items())
+    # the fractions left over go to random groups with recipes to spare
+    if (left := total - sum(counts.values())) > 0:
+        spare = [g for g in shares for _ in range(sizes[g] - counts[g])]
+        for g in random.sample(spare, min(len(spare), left)):
+            counts[g] += 1
+    return counts
+
+
+def sample_pool(recipes, numrecipes, specs, size, logger=None):
+    '''
+    down-samples the pool to about size candidates without losing any solution
+    recipes: list of Recipes to choose from
+    numrecipes: number of recipes to choose
+    specs: list of (kind, found recipes, count, operator, exclude), see Menu.constraint_specs
+    size: number of candidates to aim for
+
+    recipes that match exactly the same constraints are interchangeable, and a menu can't contain
+    more of them than numrecipes or the count of a <= or == constraint they match.  At least that
+    many of each such group are kept, groups no menu can contain are dropped, and the rest of the
+    sample is split between the groups in proportion to their size.  The sample is larger than size when the constraints split the pool
+    into many groups.
+
+    Returns:
+        list of Recipes
+    '''
+    if len(recipes) <= size:
+        return list(recipes)
+    matches = [{r.id for r in found} for _, found, *_ in specs]
+    groups = defaultdict(list)
+    for r in recipes:
+        groups[tuple(r.id in m for m in matches)].append(r)
+    usable = {g: _usable(g, specs, numrecipes) for g in groups}
+    # recipes no menu can contain aren't worth sampling
+    sizes = {g: len(members) for g, members in groups.items() if usable[g]}
+    minimums = {g: min(sizes[g], usable[g]) for g in sizes}
+    sample = []
+    for g, count in _allocate(sizes, minimums, size).items():
+        sample += random.sample(groups[g], count)
+    if logger and len(sample) > 2 * size:
+        logger.info('The constraints split the recipes into %d groups, sampled %d recipes instead of %d.', len(groups), len(sample), size)
+    return sample
+
+
+def solve_specs(recipes, numrecipes, specs, log=logging.INFO, sample=0, report=True):
+    '''
+    builds and solves a model in one call so it can run in a worker process
+    recipes: list of Recipes to choose from
+    numrecipes: number of recipes to choose
+    specs: list of (kind, found recipes, count, operator, exclude), see Menu.constraint_specs
+    sample: solve with a sample of this many recipes first, see sample_pool; 0 to always use every recipe
+    report: log that the criteria need adjusting when there is no solution, see RecipePicker.solve
+
+    Returns:
+        list of ids of the chosen recipes
+    '''
+    # forked workers inherit the parent's random state, every solve gets its own
+    random.seed()
+    logger = logging.getLogger('RecipePicker')
+    logger.loglevel = log
+
+    def _solve(candidates, report=True):
+        picker = RecipePicker(candidates, numrecipes, logger=logger)
+        for kind, found_recipes, count, operator, exclude in specs:
+            picker.add_constraint(kind, found_recipes, count, operator, exclude=exclude)
+        return [r.id for r in picker.solve(report=report)]
+
+    if sample and len(recipes) > sample:
+        try:
+            return _solve(sample_pool(recipes, numrecipes, specs, sample, logger=logger), report=False)
+        except RuntimeError:
+            logger.info('No solution with the sampled recipes, solving with all of them.')
+    return _solve(recipes, report=report)
@@ -1,33 +1,225 @@
+import hashlib
+import json
 import logging
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+from tracing import tracer
+from utils import TQDM, cached, display_progress
 
-import requests
 
-from utils import TQDM, cached, display_progress
+# statuses that mean the server is busy or briefly unavailable, the request can be sent again
+RETRY_STATUSES = (429, 502, 503, 504)
+# statuses that mean the server didn't act on the request, so even a POST can be sent again
+NOT_PROCESSED_STATUSES = (429, 503)
 
 
 class TandoorAPIError(Exception):
     pass
 
 
+class RateLimiter:
+    '''
+    token bucket shared by every request of a TandoorAPI
+    rate: requests per second
+    burst: requests that can be sent at once after a quiet period
+    '''
+
+    def __init__(self, rate, burst=10):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_after(response):
+    '''
+    Returns:
+        seconds the server asked to wait in its Retry-After header, or None
+    '''
+    if not (value := response.headers.get('Retry-After')):
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
 class TandoorAPI:
 
     def __init__(self, url, token, logger, **kwargs):
         self.logger = logger
         self.progress = None
-        if self.logger.loglevel != logging.DEBUG:
+        # a progress bar is only useful when someone is watching the terminal
+        if self.logger.loglevel != logging.DEBUG and kwargs.get('progress', True) and sys.stderr.isatty():
             self.progress = TQDM(total=100)
         self.ttl = kwargs.get('cache', 240)
+        # minutes to cache each endpoint family, e.g. {'keyword': 10080, 'recipe': {'ttl': 60, 'stale': 1440}}
+        self.policies = kwargs.get('cache_policy') or {}
+        # caches.db when not set, or a redis:// url for a cache shared between machines
+        self.cache_backend = kwargs.get('cache_backend')
         self.token = token
         self.page_size = kwargs.get('page_size', 100)
         self.include_children = kwargs.get('include_children', True)
+        self.retries = int(kwargs.get('retries', 3))
+        self.backoff = kwargs.get('backoff', 0.5)
+        self.max_backoff = kwargs.get('max_backoff', 30)
+        rate_limit = float(kwargs.get('rate_limit') or 0)
+        self.limiter = RateLimiter(rate_limit, int(kwargs.get('rate_burst') or 10)) if rate_limit > 0 else None
         if url and url[-1] == '/':
             self.url = f"{url}api/"
         else:
             self.url = f"{url}/api/"
+        # keys of a shared cache are scoped to the server and the token, without storing the token
+        url_hash = hashlib.sha256(self.url.encode('utf-8')).hexdigest()[:16]
+        token_hash = hashlib.sha256(str(token).encode('utf-8')).hexdigest()[:16]
+        self.cache_namespace = f'tandoor-menu:{url_hash}:{token_hash}'
         self.headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {self.token}'
         }
+        self._session = None
+        # GET responses of this run, shared by identical requests whatever the cache settings
+        self._memo = {}
+        self._inflight = {}
+        self._memo_lock = threading.Lock()
+        # meal types already known, e.g. from a snapshot, by their id as a string; they aren't fetched again
+        self.meal_types = {}
+
+    @property
+    def session(self):
+        # a session keeps connections to the server alive between requests
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+            self._session.headers.update(self.headers)
+        return self._session
+
+    def _send(self, method, url, **kwargs):
+        if self.limiter:
+            self.limiter.acquire()
+        with tracer.span(method, category='http') as span:
+            if tracer.enabled:
+                # collapse object ids so requests for different objects share one endpoint label
+                endpoint = re.sub(r'/\d+', '/{id}', url.split('/api/', 1)[-1].split('?', 1)[0])
+                span.set(method=method, endpoint=endpoint, cache=tracer.cache_state() if method == 'GET' else 'none')
+            response = self.session.request(method, url, **kwargs)
+            span.set(status=response.status_code, bytes=len(response.content))
+        return response
+
+    def _request(self, method, url, **kwargs):
+        '''
+        sends a request, retrying with jittered exponential backoff while the server is busy or unreachable
+        '''
+        from requests.exceptions import ConnectionError, Timeout
+        attempt = 0
+        while True:
+            try:
+                response = self._send(method, url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                # a POST may have been created before the connection broke
+                if attempt >= self.retries or method == 'POST':
+                    raise
+                delay, reason = None, str(e)
+            else:
+                retriable = response.status_code in (RETRY_STATUSES if method != 'POST' else NOT_PROCESSED_STATUSES)
+                if not retriable or attempt >= self.retries:
+                    return response
+                delay, reason = retry_after(response), f'status {response.status_code}'
+                if delay is not None and delay > self.max_backoff * 4:
+                    # not worth waiting for, fail now
+                    return response
+            if delay is None:
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            attempt += 1
+            self.logger.debug('%s %s failed with %s, retry %d of %d in %.1f seconds.', method, url, reason, attempt, self.retries, delay)
+            time.sleep(delay)
+
+    def _get(self, url, params=None):
+        key = (url, json.dumps(params, sort_keys=True, default=str))
+        with self._memo_lock:
+            if (response := self._memo.get(key)) is not None:
+                flight, leader = None, False
+            elif (flight := self._inflight.get(key)) is None:
+                flight = self._inflight[key] = Future()
+                leader = True
+            else:
+                leader = False
+        if response is not None or not leader:
+            # identical requests in flight wait for the first one instead of asking again
+            with tracer.span('memo', category='cache', function='request_memo', result='hit' if response is not None else 'shared'):
+                return response if response is not None else flight.result()
+
+        try:
+            response = self._request('GET', url, params=params)
+        except Exception as e:
+            with self._memo_lock:
+                del self._inflight[key]
+            flight.set_exception(e)
+            raise
+        with self._memo_lock:
+            if response.status_code == 200:
+                self._memo[key] = response
+            del self._inflight[key]
+        flight.set_result(response)
+        return response
+
+    def invalidate(self, url):
+        '''
+        forgets memoized responses of the endpoint family a write went to
+        '''
+        family = self.cache_family(None, [url])
+        with self._memo_lock:
+            for key in [k for k in self._memo if self.cache_family(None, [k[0]]) == family]:
+                del self._memo[key]
+
+    def reset_memo(self):
+        # the memo keeps whole responses, so it is dropped once a phase of the run is done with them
+        with self._memo_lock:
+            self._memo = {}
+
+    def cache_family(self, func_name, args):
+        if func_name == 'get_recipe_details':
+            return 'recipe'
+        if func_name == 'get_food_substitutes':
+            return 'food'
+        url = str(args[0]) if args else ''
+        return url.split('/api/', 1)[-1].split('?', 1)[0].split('/', 1)[0]
+
+    def cache_policy(self, func_name, args):
+        """
+        Look up how long the result of a cached call is kept.
+        Returns:
+            tuple: minutes the result is fresh, and minutes after that it is still served while it is
+            refreshed in the background.
+        """
+        policy = self.policies.get(self.cache_family(func_name, args), self.policies.get('default', self.ttl))
+        if isinstance(policy, dict):
+            return int(policy.get('ttl', self.ttl)), int(policy.get('stale', 0))
+        return int(policy), 0
 
     def update_progress(self):
         if self.progress:
@@ -39,20 +231,24 @@ class TandoorAPI:
         results = []
         is_first_page = True
         while url:
-            self.logger.debug(f'Connecting to tandoor api at url: {url}')
-            self.logger.debug(f'Connecting with params: {str(params)}')
+            self.logger.debug('Connecting to tandoor api at url: %s', url)
+            self.logger.debug('Connecting with params: %s', params)
             if not is_first_page and '?' in url:
                 params = None
             is_first_page = False
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self._get(url, params=params)
 
             if response.status_code != 200:
                 self.logger.info(f"Failed to fetch data. Status code: {response.status_code}: {response.text}")
                 raise TandoorAPIError(f"Failed to fetch data. Status code: {response.status_code}: {response.text}")
 
             content = response.json()
+            if isinstance(content, list):
+                # endpoints without pagination return the list itself
+                results = results + content
+                break
             new_results = content.get('results', [])
-            self.logger.debug(f'Retrieved {len(new_results)} results.')
+            self.logger.debug('Retrieved %d results.', len(new_results))
             results = results + new_results
             url = content.get('next', None)
         return results
@@ -61,8 +257,8 @@ class TandoorAPI:
     @cached
     def get_unpaged_results(self, url, obj_id, **kwargs):
         url = f'{url}{obj_id}'
-        self.logger.debug(f'Connecting to tandoor api at url: {url}')
-        response = requests.get(url, headers=self.headers)
+        self.logger.debug('Connecting to tandoor api at url: %s', url)
+        response = self._get(url)
 
         if response.status_code != 200:
             self.logger.info(f"Failed to fetch data. Status code: {response.status_code}: {response.text}")
@@ -71,7 +267,8 @@ class TandoorAPI:
 
     def create_object(self, url, data, **kwargs):
         self.logger.debug(f'Create object with tandoor api at url: {url}')
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self._request('POST', url, json=data)
+        self.invalidate(url)
 
         if response.status_code == 201:
             return response.json()
@@ -81,7 +278,8 @@ class TandoorAPI:
 
     def delete_object(self, url, obj_id, **kwargs):
         self.logger.debug(f'Deleteing object with tandoor api at url: {url}')
-        response = requests.delete(f'{url}{obj_id}', headers=self.headers)
+        response = self._request('DELETE', f'{url}{obj_id}')
+        self.invalidate(url)
 
         if response.status_code != 204:
             self.logger.info(f'Error deleting object: {response.text}')
@@ -107,14 +305,14 @@ class TandoorAPI:
         if not isinstance(filters, list):
             filters = [filters]
         for f in filters:
-            recipes += self.get_paged_results(url, {'page_size': self.page_size, 'filter': f})
+            recipes += self.get_paged_results(url, {'page_size': self.page_size, 'filter': f}, refresh=kwargs.get('refresh', False))
 
-        self.logger.debug(f'Returning {len(recipes)} total recipes.')
+        self.logger.debug('Returning %d total recipes.', len(recipes))
         return recipes
 
     @display_progress
     @cached
-    def get_recipe_details(self, recipe_id):
+    def get_recipe_details(self, recipe_id, **kwargs):
         """
         Fetch details of a specific recipe by its ID.
         Args:
@@ -123,7 +321,7 @@ class TandoorAPI:
             dict: Details of the recipe in JSON-LD format.
         """
         url = f"{self.url}recipe/{recipe_id}"
-        response = requests.get(url, headers=self.headers)
+        response = self._get(url)
 
         if response.status_code == 200:
             return response.json()
@@ -162,6 +360,27 @@ class TandoorAPI:
         self.logger.debug(f'Returning {len(foods)} total food.')
         return foods
 
+    @display_progress
+    @cached
+    def get_hierarchy(self, url, **kwargs):
+        """
+        Fetch every keyword or food from the API and build their closure table.
+        Returns:
+            Hierarchy: the tree of all objects at url.
+        """
+        from hierarchy import Hierarchy
+        # the closure table is cached, the list it is built from doesn't need to be
+        nodes = self.get_paged_results(url, {'page_size': self.page_size}, ttl=0)
+
+        self.logger.debug(f'Returning hierarchy of {len(nodes)} objects from {url}.')
+        return Hierarchy(nodes)
+
+    def get_keyword_hierarchy(self, **kwargs):
+        return self.get_hierarchy(f"{self.url}keyword/", **kwargs)
+
+    def get_food_hierarchy(self, **kwargs):
+        return self.get_hierarchy(f"{self.url}food/", **kwargs)
+
     def get_food(self, food_id, **kwargs):
         """
         Fetch a food from the API.
@@ -172,7 +391,7 @@ class TandoorAPI:
         url = f"{self.url}food/"
         food = self.get_unpaged_results(url, food_id, **kwargs)
 
-        self.logger.debug(f'Returning food {food["id"]}: {food["name"]}.')
+        self.logger.debug('Returning food %s: %s.', food['id'], food['name'])
         return food
 
     def get_book(self, book_id, **kwargs):
@@ -185,7 +404,7 @@ class TandoorAPI:
         url = f"{self.url}recipe-book/"
         book = self.get_unpaged_results(url, book_id, **kwargs)
 
-        self.logger.debug(f'Returning book {book["id"]}: {book["name"]}.')
+        self.logger.debug('Returning book %s: %s.', book['id'], book['name'])
         return book
 
     def get_book_recipes(self, book, **kwargs):
@@ -199,29 +418,30 @@ class TandoorAPI:
         book_entries = self.get_unpaged_results(url, '', **kwargs)
         recipes = [be['recipe_content'] for be in book_entries]
         if book.filter:
-            recipes += self.get_recipes(filters=book.filter)
+            recipes += self.get_recipes(filters=book.filter, refresh=kwargs.get('refresh', False))
 
-        self.logger.debug(f'Returning book {book.id}: {book.name} with {len(recipes)} recipes.')
+        self.logger.debug('Returning book %s: %s with %d recipes.', book.id, book.name, len(recipes))
         return recipes
 
-    def get_mealplan_recipes(self, mealtype_id=None, date=None, params=None, **kwargs):
+    def get_mealplan_recipes(self, mealtype_id=None, date=None, params=None, end=None, **kwargs):
         """
-        Fetch all recipes of mealtype.
+        Fetch all recipes of mealtype planned from date through end, in one query.
         Returns:
-            list: List of recipes.
+            list: List of recipes, each recipe once.
         """
 
         if not mealtype_id:
             return []
         if not isinstance(mealtype_id, list):
             mealtype_id = [mealtype_id]
+        end = end or date
 
-        url = f"{self.url}meal-plan/?from_date={date.strftime('%Y-%m-%d')}&to_date={date.strftime('%Y-%m-%d')}"
-        for mt in mealtype_id:
-            url = url + f"&meal_type={mt}"
-
-        self.logger.debug(f"Returning recipes from meal plan on {date.strftime('%Y-%m-%d')} with meal play type IDs: {mealtype_id}.")
-        return [r['recipe'] for r in self.get_unpaged_results(url, '', **kwargs)]
+        recipes = {}
+        for plan in self.get_meal_plans(date, end=end, meal_types=mealtype_id, **kwargs):
+            if plan.get('recipe'):
+                recipes.setdefault(plan['recipe']['id'], plan['recipe'])
+        self.logger.debug(f"Returning {len(recipes)} recipes from meal plans from {date.strftime('%Y-%m-%d')} to {end.strftime('%Y-%m-%d')} with meal play type IDs: {mealtype_id}.")
+        return list(recipes.values())
 
     def create_meal_plan(self, recipe=None, title=None, servings=1, date=None, note=None, meal_type=None, shared=None, **kwargs):
         if shared is None:
@@ -241,7 +461,7 @@ class TandoorAPI:
                 'shared': shared,
                 'from_date': date.strftime('%Y-%m-%d'),
                 'to_date': date.strftime('%Y-%m-%d'),
-                'meal_type': self.get_unpaged_results(f'{self.url}meal-type/', meal_type)
+                'meal_type': self.meal_types.get(str(meal_type)) or self.get_unpaged_results(f'{self.url}meal-type/', meal_type)
             }
         )
 
@@ -249,9 +469,18 @@ class TandoorAPI:
 
         return plan
 
-    def get_meal_plans(self, date, **kwargs):
-        url = f"{self.url}meal-plan/?from_date={date.strftime('%Y-%m-%d')}"
-        return self.get_unpaged_results(url, '', **kwargs)
+    def get_meal_plans(self, date, end=None, meal_types=None, **kwargs):
+        """
+        Fetch the meal plans from date, through end if given, of any of meal_types if given.
+        Returns:
+            list: List of meal plans in tandoor format.
+        """
+        params = {'from_date': date.strftime('%Y-%m-%d'), 'page_size': self.page_size}
+        if end:
+            params['to_date'] = end.strftime('%Y-%m-%d')
+        if meal_types:
+            params['meal_type'] = list(meal_types)
+        return self.get_paged_results(f"{self.url}meal-plan/", params, **kwargs)
 
     def delete_meal_plan(self, obj_id, **kwargs):
         url = f"{self.url}meal-plan/"
@@ -262,8 +491,8 @@ class TandoorAPI:
     @cached
     def get_food_substitutes(self, id, substitute):
         url = f"{self.url}{substitute}/{id}/substitutes/"
-        self.logger.debug(f'Connecting to tandoor api at url: {url}')
-        response = requests.get(url, headers=self.headers, params={'onhand': 1})
+        self.logger.debug('Connecting to tandoor api at url: %s', url)
+        response = self._get(url, params={'onhand': 1})
 
         if response.status_code != 200:
             self.logger.info(f"Failed to fetch food substitutes. Status code: {response.status_code}: {response.text}")
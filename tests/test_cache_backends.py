@@ -0,0 +1,48 @@
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import cache_backends
+from benchmarks.fake_redis import FakeRedisServer
+from cache_backends import RedisBackend
+
+
+@pytest.fixture
+def redis_url():
+    server = FakeRedisServer(('127.0.0.1', 0), password='secret')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'redis://:secret@127.0.0.1:{server.server_address[1]}/1'
+    server.shutdown()
+    server.server_close()
+
+
+def test_redis_round_trip(redis_url):
+    backend = RedisBackend(redis_url)
+    backend.set('key', {'data': [1, 2]}, datetime.now() + timedelta(minutes=5))
+    assert backend.get('key') == {'data': [1, 2]}
+    assert backend.get('missing') is None
+    backend.close()
+
+
+def test_unreachable_server_is_skipped_during_cooldown(monkeypatch):
+    attempts = []
+
+    def _refuse(address, timeout=None):
+        attempts.append(address)
+        raise ConnectionRefusedError('refused')
+
+    monkeypatch.setattr(socket, 'create_connection', _refuse)
+    backend = RedisBackend('redis://127.0.0.1:1/0', cooldown=60)
+    for _ in range(5):
+        assert backend.get('key') is None
+        backend.set('key', {}, datetime.now() + timedelta(minutes=5))
+    # the first call tries twice, the rest are misses without connecting
+    assert len(attempts) == 2
+    assert backend.warned
+
+    monkeypatch.setattr(cache_backends.time, 'monotonic', lambda: backend.down_until + 1)
+    assert backend.get('key') is None
+    assert len(attempts) == 4
@@ -0,0 +1,22 @@
+import logging
+from types import SimpleNamespace
+
+from create_menu import Menu, parse_args, validate_args
+
+
+def _menu(tmp_path, *argv):
+    config = tmp_path / 'config.ini'
+    config.write_text('[conditions]\nchoices: 5\n')
+    args = parse_args(['-c', str(config), '--url', 'http://tandoor', '--token', 't', *argv])
+    validate_args(args)
+    return Menu(args, tandoor=SimpleNamespace(get_recipes=None, get_mealplan_recipes=None), logger=logging.getLogger('test'))
+
+
+def test_meal_plan_calls_differ_by_date_range(tmp_path):
+    # profiles with the same plan type but other ranges must not share the call when prefetching
+    week = _menu(tmp_path, '--plan_type=3', '--plan_from=2026-03-02', '--plan_to=2026-03-08')
+    month = _menu(tmp_path, '--plan_type=3', '--plan_from=2026-03-01', '--plan_to=2026-03-31')
+    again = _menu(tmp_path, '--plan_type=3', '--plan_from=2026-03-02', '--plan_to=2026-03-08')
+    week, month, again = ({description for description, _ in m.fetch_plan()[0]} for m in (week, month, again))
+    assert week != month
+    assert week == again
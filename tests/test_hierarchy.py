@@ -0,0 +1,35 @@
+from hierarchy import Hierarchy
+
+NODES = [
+    {'id': 1, 'name': 'meat', 'parent': None},
+    {'id': 2, 'name': 'poultry', 'parent': 1},
+    {'id': 3, 'name': 'chicken', 'parent': {'id': 2}},
+    {'id': 4, 'name': 'beef', 'parent': 1},
+    {'id': 5, 'name': 'vegetables'},
+    # its parent isn't in the list, e.g. deleted
+    {'id': 6, 'name': 'orphan', 'parent': 99},
+]
+
+
+def test_closure_holds_every_descendant():
+    tree = Hierarchy(NODES)
+    assert tree.descendant_ids(1) == {1, 2, 3, 4}
+    assert tree.descendant_ids(2) == {2, 3}
+    assert tree.descendant_ids(3) == {3}
+    assert tree.descendant_ids(5) == {5}
+    assert tree.descendant_ids(6) == {6}
+    assert sorted(n['name'] for n in tree.descendants(2)) == ['chicken', 'poultry']
+
+
+def test_ids_may_be_strings():
+    tree = Hierarchy(NODES)
+    assert '3' in tree and 3 in tree
+    assert 99 not in tree and 'meat' not in tree
+    assert tree.node('4')['name'] == 'beef'
+    assert len(tree) == 6
+
+
+def test_cycles_end():
+    tree = Hierarchy([{'id': 1, 'parent': 2}, {'id': 2, 'parent': 1}])
+    assert tree.descendant_ids(1) == {1, 2}
+    assert tree.descendant_ids(2) == {1, 2}
@@ -0,0 +1,99 @@
+import logging
+from argparse import Namespace
+from itertools import permutations
+
+import pytest
+
+pytest.importorskip('reportlab')
+pytest.importorskip('svglib')
+from reportlab.graphics import renderPDF  # noqa: E402
+from reportlab.graphics.shapes import Drawing, Group, Rect, String  # noqa: E402
+
+from menu import MenuGenerator, assign_slots  # noqa: E402
+
+
+class _Ingredient:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Recipe:
+    def __init__(self, name, ingredients=()):
+        self.name = name
+        self.ingredients = [_Ingredient(i) for i in ingredients]
+
+
+def _generator(recipe_text=(), output_dir=None, file_format=('PNG',)):
+    options = Namespace(
+        output_dir=output_dir, file_template='menu.svg', file_format=list(file_format), fonts=[], separator=', ',
+        replace_text={'recipe_text': list(recipe_text)}
+    )
+    logger = logging.getLogger('test')
+    logger.loglevel = logging.INFO
+    return MenuGenerator(None, options, logger)
+
+
+def test_assign_slots_is_optimal():
+    cost = [[4, 1, 3], [2, 0, 5], [3, 2, 2]]
+    best = min(sum(cost[i][j] for i, j in enumerate(p)) for p in permutations(range(3)))
+    result = assign_slots(cost)
+    assert sorted(result) == [0, 1, 2]
+    assert sum(cost[i][j] for i, j in enumerate(result)) == best
+
+
+def test_assign_slots_with_more_items_than_slots():
+    result = assign_slots([[5, 1, 9], [1, 5, 9]])
+    assert result == [1, 0]
+
+
+def test_assign_slots_empty():
+    assert assign_slots([]) == []
+
+
+def test_assign_slots_with_more_slots_than_items():
+    with pytest.raises(ValueError):
+        assign_slots([[1], [2]])
+
+
+def test_prepare_replacement_keeps_short_names_in_place():
+    generator = _generator([{'name': 'AAAAAAAA'}, {'name': 'BBBB'}])
+    replacements = generator.prepare_replacement([_Recipe('Longer name'), _Recipe('Pie')])
+    # the long name moves to the long slot
+    assert replacements == {'AAAAAAAA': 'Longer n', 'BBBB': 'Pie'}
+
+
+def test_prepare_replacement_blanks_slots_without_recipes():
+    generator = _generator([{'name': 'AAAA', 'ingredients': ['aaaa']}, {'name': 'BBBB', 'ingredients': ['bbbb']}])
+    replacements = generator.prepare_replacement([_Recipe('Pie', ['egg'])])
+    assert replacements['AAAA'] == 'Pie'
+    assert replacements['BBBB'] == ''
+    assert replacements['bbbb'] == ''
+
+
+def test_prepare_replacement_without_recipes():
+    generator = _generator([{'name': 'AAAA'}])
+    assert generator.prepare_replacement([]) == {'AAAA': ''}
+
+
+def test_formats_render_concurrently_from_separate_drawings(tmp_path, monkeypatch):
+    drawing = Drawing(400, 400)
+    for i in range(200):
+        group = Group()
+        group.add(Rect(i, i, 10, 10))
+        group.add(String(i, i, 'menu' * 5))
+        drawing.add(group)
+    generator = _generator(output_dir=str(tmp_path), file_format=['PNG', 'PDF'])
+    rendered = []
+
+    def _render_bitmaps(drawing, formats):
+        # stands in for the rasterizer, which walks the drawing the same way
+        rendered.append(drawing)
+        output_file = str(tmp_path / 'menu.PNG')
+        renderPDF.drawToFile(drawing, output_file)
+        return [output_file]
+
+    monkeypatch.setattr(generator, 'load_drawing', lambda template: drawing)
+    monkeypatch.setattr(generator, 'render_bitmaps', _render_bitmaps)
+    for _ in range(20):
+        assert len(generator.convert_svg('<svg/>')) == 2
+    assert all(d is drawing for d in rendered)
@@ -0,0 +1,59 @@
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+
+from planner import plan_pushdown, polarity
+
+LOGGER = logging.getLogger('test')
+
+
+@pytest.mark.parametrize('count, operator, exclude, expected', [
+    (5, '>=', False, True),
+    (5, '==', False, True),
+    (0, '<=', False, False),
+    (0, '==', False, False),
+    (5, '>=', True, False),
+    (0, '<=', 'true', True),
+    (3, '>=', False, None),
+    (1, '<=', False, None),
+])
+def test_polarity(count, operator, exclude, expected):
+    assert polarity({'count': count, 'operator': operator, 'exclude': exclude}, 5) is expected
+
+
+def test_keywords_are_pushed_down():
+    params = plan_pushdown({'keyword': [
+        {'condition': [1, 2], 'count': 5, 'operator': '>='},
+        {'condition': [3], 'count': 5, 'operator': '>='},
+        {'condition': 4, 'count': 0, 'operator': '=='},
+        {'condition': [5], 'count': 5, 'operator': '==', 'exclude': True},
+        {'condition': [6], 'count': 2, 'operator': '>='},
+    ]}, 5, LOGGER)
+    # only the first required keyword list is used, every excluded one is
+    assert params == {'keywords_or': [1, 2], 'keywords_or_not': [4, 5]}
+
+
+def test_rating_is_pushed_down():
+    assert plan_pushdown({'rating': [{'condition': 3.5, 'count': 5, 'operator': '>='}]}, 5, LOGGER) == {'rating': 3}
+    assert plan_pushdown({'rating': [{'condition': -2.5, 'count': 5, 'operator': '>='}]}, 5, LOGGER) == {'rating': -3}
+    # unrated recipes would be wanted, the server can't return them
+    assert plan_pushdown({'rating': [{'condition': 3, 'count': 0, 'operator': '=='}]}, 5, LOGGER) == {}
+    assert plan_pushdown({'rating': [{'condition': 0.5, 'count': 5, 'operator': '>='}]}, 5, LOGGER) == {}
+
+
+def test_dates_are_widened():
+    day = datetime(2026, 3, 10)
+    params = plan_pushdown({
+        'createdon': [{'condition': '2026-03-10', 'count': 5, 'operator': '>='}],
+        'cookedon': [{'condition': '2026-03-10', 'count': 0, 'operator': '<='}],
+    }, 5, LOGGER)
+    # created on or after the day, with a day of margin; never cooked recipes keep cookedon local
+    assert params == {'createdon': (day - timedelta(days=1)).strftime('%Y-%m-%d')}
+
+
+def test_modifiers_only_push_required_conditions():
+    constraints = {'keyword': [{'condition': [1], 'count': 0, 'operator': '==', 'cooked': '30days'}]}
+    assert plan_pushdown(constraints, 5, LOGGER) == {}
+    constraints = {'keyword': [{'condition': [1], 'count': 5, 'operator': '==', 'cooked': '30days'}]}
+    assert plan_pushdown(constraints, 5, LOGGER) == {'keywords_or': [1]}
@@ -0,0 +1,59 @@
+import json
+import logging
+from argparse import Namespace
+
+import pytest
+
+from models import Recipe
+from scenarios import apply_overrides, load_scenarios, solve_scenario
+
+
+def _args():
+    return Namespace(
+        choices=5, keyword=["{'condition': [1, 2], 'count': 1, 'operator': '>='}"], food=[], book=[],
+        rating=['{"condition": 3, "count": 2, "operator": ">="}'], cookedon=[], createdon=[]
+    )
+
+
+def test_options_and_constraints_are_overridden():
+    args = _args()
+    varied = apply_overrides(args, {'choices': 7, 'keyword.0.count': 3, 'book': {'condition': 4, 'count': 1, 'operator': '<='}})
+    assert varied.choices == 7
+    assert json.loads(varied.keyword[0]) == {'condition': [1, 2], 'count': 3, 'operator': '>='}
+    assert [json.loads(b) for b in varied.book] == [{'condition': 4, 'count': 1, 'operator': '<='}]
+    assert json.loads(varied.rating[0])['condition'] == 3
+    # the base options are left alone
+    assert args.choices == 5 and args.book == []
+
+
+@pytest.mark.parametrize('key', ['keyword.3.count', 'keyword.x.count', 'colour'])
+def test_unknown_overrides_are_refused(key):
+    with pytest.raises(ValueError):
+        apply_overrides(_args(), {key: 1})
+
+
+def test_grid_is_applied_to_every_variant(tmp_path):
+    path = tmp_path / 'scenarios.yaml'
+    path.write_text('variants:\n  - name: base\n  - name: more\n    choices: 7\ngrid:\n  keyword.0.count: [1, 3]\n')
+    assert load_scenarios(str(path)) == [
+        ('base: keyword.0.count=1', {'keyword.0.count': 1}),
+        ('base: keyword.0.count=3', {'keyword.0.count': 3}),
+        ('more: keyword.0.count=1', {'choices': 7, 'keyword.0.count': 1}),
+        ('more: keyword.0.count=3', {'choices': 7, 'keyword.0.count': 3}),
+    ]
+
+
+def test_list_of_variants(tmp_path):
+    path = tmp_path / 'scenarios.yaml'
+    path.write_text('- choices: 3\n- name: seven\n  choices: 7\n')
+    assert load_scenarios(str(path)) == [('variant 1', {'choices': 3}), ('seven', {'choices': 7})]
+
+
+def test_infeasible_variant_is_not_reported_as_error(caplog):
+    recipes = [Recipe.from_fields(id=i, name=str(i)) for i in range(10)]
+    # five recipes from a keyword only two of them have
+    specs = [('keyword', recipes[:2], 5, '>=', False)]
+    with caplog.at_level(logging.INFO, logger='RecipePicker'):
+        feasible, _, ids = solve_scenario(recipes, 5, specs, logging.INFO)
+    assert (feasible, ids) == (False, [])
+    assert 'adjustment of criteria' not in caplog.text
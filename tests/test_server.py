@@ -0,0 +1,57 @@
+import logging
+
+import pytest
+
+import server
+from create_menu import parse_args
+from server import InvalidRequest, MenuServer, server_argv
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / 'config.ini'
+    path.write_text('[conditions]\nchoices: 5\n')
+    return str(path)
+
+
+@pytest.fixture
+def make_server(monkeypatch):
+    logger = logging.getLogger('test')
+    logger.loglevel = logging.INFO
+    monkeypatch.setattr(server, 'setup_logging', lambda **kwargs: logger)
+
+    def _make(argv):
+        return MenuServer(parse_args(argv), argv)
+    return _make
+
+
+@pytest.mark.parametrize('argv, expected', [
+    (['--serve'], []),
+    (['--serve', '127.0.0.1:9000', '--choices', '3'], ['--choices', '3']),
+    (['--serve', '--choices', '3'], ['--choices', '3']),
+    (['--serve=/tmp/menu.sock', '-c', 'x.ini'], ['-c', 'x.ini']),
+])
+def test_serve_is_left_out(argv, expected):
+    assert server_argv(argv) == expected
+
+
+def test_startup_options_apply_to_requests(make_server, config):
+    menu_server = make_server(['-c', config, '--url', 'http://tandoor', '--token', 't', '--choices', '3', '--serve'])
+    args = menu_server.parse({})
+    assert (args.url, args.token, args.choices, args.serve) == ('http://tandoor', 't', '3', None)
+    assert menu_server.parse({'choices': 7}).choices == '7'
+
+
+def test_negative_relative_dates(make_server, config):
+    menu_server = make_server(['-c', config, '--url', 'http://tandoor', '--token', 't', '--serve'])
+    args = menu_server.parse({'cleanup_date': '-7days', 'plan_from': '-14days', 'plan_type': [3]})
+    assert args.cleanup_date == '-7days'
+    assert args.plan_from.date() < args.plan_to.date()
+
+
+def test_invalid_values_are_request_errors(make_server, config):
+    menu_server = make_server(['-c', config, '--url', 'http://tandoor', '--token', 't', '--serve'])
+    with pytest.raises(InvalidRequest):
+        menu_server.parse({'plan_from': '0days', 'plan_to': '-3days', 'plan_type': [3]})
+    with pytest.raises(InvalidRequest):
+        menu_server.run({'choices': 'abc'}, 0)
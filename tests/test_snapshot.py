@@ -0,0 +1,96 @@
+import pytest
+
+from hierarchy import Hierarchy
+from models import Recipe
+from snapshot import HEADER, MAGIC, Snapshot, SnapshotError, write_snapshot
+
+
+def _recipe(id, **fields):
+    recipe = {
+        'id': id, 'name': f'Recipe {id}', 'description': 'Crème brûlée ✓', 'new': False, 'servings': 2,
+        'keywords': [{'id': 2}, {'id': 3}], 'last_cooked': None, 'created_at': '2026-01-02T03:04:05.123456+02:00', 'rating': None
+    }
+    recipe.update(fields)
+    return Recipe(recipe)
+
+
+def _fields(recipe):
+    return (
+        recipe.id, recipe.name, recipe.description, recipe.new, recipe.servings, recipe.keywords,
+        recipe.cookedon, recipe.createdon, recipe.rating
+    )
+
+
+KEYWORDS = [{'id': 1, 'name': 'root', 'parent': None}, {'id': 2, 'name': 'child', 'parent': 1}, {'id': 3, 'name': 'leaf', 'parent': {'id': 2}}]
+FOODS = [{'id': 10, 'name': 'egg', 'parent': None}, {'id': 11, 'name': 'duck egg', 'parent': 10}]
+
+
+@pytest.fixture
+def recipes():
+    return [
+        _recipe(5, rating=4.5, last_cooked='2026-03-01T12:00:00-05:00'),
+        _recipe(1, new=True, servings=None, keywords=[], created_at='2025-12-31T23:59:59'),
+        _recipe(3, description='', rating=0, last_cooked='2026-02-01T00:00:00'),
+    ]
+
+
+@pytest.fixture
+def snapshot(tmp_path, recipes):
+    path = str(tmp_path / 'menu.snap')
+    write_snapshot(
+        path, recipes, keywords=Hierarchy(KEYWORDS), foods=Hierarchy(FOODS),
+        books={7: {'id': 7, 'name': 'Weeknights'}}, memberships={7: {1, 5}},
+        postings={10: {1, 3}, 11: {5}}, meal_types={4: {'id': 4, 'name': 'Dinner'}}, source='http://tandoor/api/'
+    )
+    return Snapshot(path)
+
+
+def test_recipes_round_trip(snapshot, recipes):
+    assert sorted(map(_fields, snapshot.recipes())) == sorted(map(_fields, recipes))
+
+
+def test_hierarchies_round_trip(snapshot):
+    for kind, nodes in (('keyword', KEYWORDS), ('food', FOODS)):
+        expected, tree = Hierarchy(nodes), snapshot.hierarchy(kind)
+        assert len(tree) == len(expected)
+        for node in nodes:
+            assert node['id'] in tree and str(node['id']) in tree
+            assert tree.node(node['id']) == expected.node(node['id'])
+            assert tree.descendant_ids(node['id']) == expected.descendant_ids(node['id'])
+        assert 99 not in tree and 'x' not in tree
+    assert snapshot.hierarchy('keyword').descendant_ids(1) == {1, 2, 3}
+
+
+def test_books_postings_and_meal_types(snapshot):
+    assert snapshot.book('7') == {'id': 7, 'name': 'Weeknights'}
+    assert snapshot.book_recipes(7) == {1, 5}
+    with pytest.raises(SnapshotError):
+        snapshot.book_recipes(8)
+    assert snapshot.recipes_with([10, 11, 12]) == {1, 3, 5}
+    assert snapshot.meal_types() == {4: {'id': 4, 'name': 'Dinner'}}
+
+
+def test_missing_sections_are_reported(tmp_path, recipes):
+    path = str(tmp_path / 'plain.snap')
+    write_snapshot(path, recipes)
+    snapshot = Snapshot(path)
+    assert len(snapshot.recipes()) == 3
+    assert not snapshot.has('postings')
+    with pytest.raises(SnapshotError):
+        snapshot.recipes_with([10])
+
+
+def test_other_files_are_refused(tmp_path, snapshot):
+    path = tmp_path / 'config.ini'
+    path.write_text('[create-menu]\nurl: http://tandoor\n')
+    with pytest.raises(SnapshotError):
+        Snapshot(str(path))
+
+    data = bytearray(open(snapshot.path, 'rb').read())
+    magic, version, reserved, toc_length = HEADER.unpack_from(data, 0)
+    assert magic == MAGIC
+    HEADER.pack_into(data, 0, magic, version + 1, reserved, toc_length)
+    path = tmp_path / 'newer.snap'
+    path.write_bytes(bytes(data))
+    with pytest.raises(SnapshotError, match='export it again'):
+        Snapshot(str(path))
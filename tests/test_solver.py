@@ -0,0 +1,92 @@
+import logging
+import random
+from collections import Counter
+
+import pytest
+
+from solver import RecipePicker, sample_pool
+
+
+class _Recipe:
+    def __init__(self, id):
+        self.id = id
+
+    def __repr__(self):
+        return f'<{self.id}>'
+
+
+def _feasible(recipes, numrecipes, specs):
+    logger = logging.getLogger('test')
+    logger.loglevel = logging.WARNING
+    picker = RecipePicker(recipes, numrecipes, logger=logger)
+    for kind, found, count, operator, exclude in specs:
+        picker.add_constraint(kind, found, count, operator, exclude=exclude)
+    try:
+        picker.solve(report=False)
+    except RuntimeError:
+        return False
+    return True
+
+
+@pytest.fixture
+def recipes():
+    return [_Recipe(i) for i in range(1000)]
+
+
+def test_small_pool_is_kept(recipes):
+    assert sample_pool(recipes[:50], 5, [], 100) == recipes[:50]
+
+
+def test_sample_has_the_requested_size(recipes):
+    specs = [('keyword', recipes[:300], 1, '>=', False)]
+    sample = sample_pool(recipes, 5, specs, 100)
+    assert len(sample) == 100
+    assert len({r.id for r in sample}) == 100
+
+
+def test_groups_are_sampled_in_proportion(recipes):
+    specs = [('keyword', recipes[:300], 1, '>=', False)]
+    matching = Counter(r.id < 300 for r in sample_pool(recipes, 5, specs, 100))
+    assert matching[True] == 30
+
+
+def test_rare_groups_keep_enough_recipes(recipes):
+    specs = [('keyword', recipes[:3], 1, '>=', False), ('book', recipes[3:8], 1, '>=', False)]
+    sample = {r.id for r in sample_pool(recipes, 5, specs, 50)}
+    assert set(range(8)) <= sample
+
+
+def test_quota_is_capped_by_the_constraints(recipes):
+    # at most one recipe matching the keyword can be chosen, more of them are useless
+    specs = [('keyword', recipes[:10], 1, '<=', False)]
+    sample = sample_pool(recipes, 5, specs, 20)
+    assert len(sample) == 20
+    assert sum(r.id < 10 for r in sample) == 1
+
+
+def test_excluded_group_is_dropped(recipes):
+    specs = [('keyword', recipes[:10], 0, '==', False), ('book', recipes[10:20], 2, '==', True)]
+    sample = sample_pool(recipes, 5, specs, 20)
+    assert len(sample) == 20
+    assert all(r.id >= 10 for r in sample)
+
+
+def test_many_groups_are_logged(recipes, caplog):
+    specs = [('keyword', recipes[i::2 ** (i + 1)][:500], 1, '>=', False) for i in range(8)]
+    logger = logging.getLogger('test')
+    with caplog.at_level(logging.INFO, logger='test'):
+        sample = sample_pool(recipes, 5, specs, 10, logger=logger)
+    assert len(sample) > 20
+    assert 'groups' in caplog.text
+
+
+def test_sampling_keeps_feasibility(recipes):
+    rnd = random.Random(7)
+    for _ in range(30):
+        numrecipes = rnd.randint(2, 5)
+        specs = [
+            ('keyword', rnd.sample(recipes, rnd.randint(2, 200)), rnd.randint(0, numrecipes), rnd.choice(['>=', '<=', '==']), rnd.random() < 0.2)
+            for _ in range(rnd.randint(1, 4))
+        ]
+        sample = sample_pool(recipes, numrecipes, specs, 40)
+        assert _feasible(recipes, numrecipes, specs) == _feasible(sample, numrecipes, specs)
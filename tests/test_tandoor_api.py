@@ -0,0 +1,115 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import tandoor_api
+from tandoor_api import RateLimiter, TandoorAPI, retry_after
+
+
+@pytest.fixture
+def api():
+    logger = logging.getLogger('test')
+    logger.loglevel = logging.INFO
+    return TandoorAPI('http://tandoor.local', 'token', logger, cache=0, progress=False, retries=2, backoff=0)
+
+
+class _Recipe:
+    id = 42
+    name = 'Pie'
+
+
+@pytest.mark.parametrize('mp_type', [4, '4'])
+def test_known_meal_type_is_not_fetched(api, monkeypatch, mp_type):
+    api.meal_types['4'] = {'id': 4, 'name': 'Dinner'}
+    sent = []
+    monkeypatch.setattr(api, 'get_unpaged_results', lambda *args, **kwargs: pytest.fail('meal type was fetched'))
+    monkeypatch.setattr(api, 'create_object', lambda url, data: sent.append(data) or {'id': 1})
+    api.create_meal_plan(recipe=_Recipe(), title='Pie', date=datetime(2026, 1, 1), meal_type=mp_type)
+    assert sent[0]['meal_type'] == {'id': 4, 'name': 'Dinner'}
+
+
+class _Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(tandoor_api.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(tandoor_api.time, 'sleep', clock.sleep)
+    return clock
+
+
+def _replies(api, monkeypatch, *statuses):
+    replies = [r if isinstance(r, _Response) else _Response(r) for r in statuses]
+    sent = []
+
+    def _send(method, url, **kwargs):
+        sent.append(method)
+        return replies.pop(0)
+    monkeypatch.setattr(api, '_send', _send)
+    return sent
+
+
+@pytest.mark.parametrize('value, expected', [('3', 3.0), ('-1', 0.0), (None, None), ('soon', None)])
+def test_retry_after_seconds(value, expected):
+    assert retry_after(_Response(503, {'Retry-After': value} if value else {})) == expected
+
+
+def test_retry_after_date():
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 <= retry_after(_Response(503, {'Retry-After': later})) <= 60
+
+
+def test_rate_limiter_allows_a_burst_then_spaces_requests(clock):
+    limiter = RateLimiter(rate=2, burst=3)
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == []
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == [0.5, 0.5]
+
+
+def test_busy_server_is_retried(api, monkeypatch, clock):
+    sent = _replies(api, monkeypatch, 503, _Response(429, {'Retry-After': '2'}), 200)
+    assert api._request('GET', 'http://tandoor.local/api/recipe/').status_code == 200
+    assert len(sent) == 3
+    assert clock.sleeps[1] == 2
+
+
+def test_retries_are_limited(api, monkeypatch, clock):
+    sent = _replies(api, monkeypatch, 502, 502, 502, 200)
+    assert api._request('GET', 'http://tandoor.local/api/recipe/').status_code == 502
+    assert len(sent) == 3
+
+
+def test_post_is_only_retried_when_not_processed(api, monkeypatch, clock):
+    sent = _replies(api, monkeypatch, 502)
+    assert api._request('POST', 'http://tandoor.local/api/meal-plan/').status_code == 502
+    sent = _replies(api, monkeypatch, 503, 201)
+    assert api._request('POST', 'http://tandoor.local/api/meal-plan/').status_code == 201
+    assert len(sent) == 2
+
+
+def test_long_retry_after_fails_at_once(api, monkeypatch, clock):
+    sent = _replies(api, monkeypatch, _Response(429, {'Retry-After': '3600'}), 200)
+    assert api._request('GET', 'http://tandoor.local/api/recipe/').status_code == 429
+    assert len(sent) == 1 and clock.sleeps == []
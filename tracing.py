@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'category', 'attrs', 'start', 'end', 'thread')
+
+    def __init__(self, tracer, name, category, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer.record(self)
+        return False
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class NullSpan:
+    # returned while tracing is disabled so instrumented code costs next to nothing
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        # per thread state, e.g. whether an HTTP call is the result of a cache miss
+        self.context = threading.local()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.perf_counter()
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+        self.started = time.perf_counter()
+
+    def span(self, name, category='stage', **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, attrs)
+
+    def record(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def cache_state(self):
+        return getattr(self.context, 'cache', 'none')
+
+    def set_cache_state(self, state):
+        self.context.cache = state
+
+    def trace_events(self):
+        pid = os.getpid()
+        return [{
+            'name': s.name,
+            'cat': s.category,
+            'ph': 'X',
+            'ts': round((s.start - self.started) * 1e6),
+            'dur': round(s.duration * 1e6),
+            'pid': pid,
+            'tid': s.thread,
+            'args': s.attrs
+        } for s in sorted(self.spans, key=lambda s: s.start)]
+
+    def write_trace(self, path):
+        '''
+        writes the spans in the Chrome trace event format, viewable in chrome://tracing or Perfetto
+        '''
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f, default=str)
+
+    def metrics(self):
+        stages = defaultdict(float)
+        http_count = defaultdict(int)
+        http_duration = defaultdict(float)
+        http_bytes = defaultdict(int)
+        cache = defaultdict(int)
+        for s in self.spans:
+            if s.category == 'http':
+                key = (s.attrs.get('method'), s.attrs.get('endpoint'), s.attrs.get('status'), s.attrs.get('cache'))
+                http_count[key] += 1
+                http_duration[key[:2]] += s.duration
+                http_bytes[key[:2]] += s.attrs.get('bytes', 0)
+            elif s.category == 'cache':
+                cache[(s.attrs.get('function'), s.attrs.get('result'))] += 1
+            else:
+                stages[(s.category, s.name)] += s.duration
+
+        def _labels(**labels):
+            return '{' + ','.join(f'{k}="{str(v)}"' for k, v in labels.items()) + '}'
+
+        lines = [
+            '# HELP tandoor_menu_run_duration_seconds Wall time of the run.',
+            '# TYPE tandoor_menu_run_duration_seconds gauge',
+            f'tandoor_menu_run_duration_seconds {time.perf_counter() - self.started:.6f}',
+            '# HELP tandoor_menu_stage_duration_seconds Wall time spent in each stage.',
+            '# TYPE tandoor_menu_stage_duration_seconds gauge',
+        ]
+        lines += [f'tandoor_menu_stage_duration_seconds{_labels(category=c, stage=n)} {v:.6f}' for (c, n), v in sorted(stages.items())]
+        lines += [
+            '# HELP tandoor_menu_http_requests_total Requests made to the Tandoor API.',
+            '# TYPE tandoor_menu_http_requests_total counter',
+        ]
+        lines += [f'tandoor_menu_http_requests_total{_labels(method=m, endpoint=e, status=st, cache=c)} {v}' for (m, e, st, c), v in sorted(http_count.items(), key=str)]
+        lines += [
+            '# HELP tandoor_menu_http_request_duration_seconds_total Time spent waiting on the Tandoor API.',
+            '# TYPE tandoor_menu_http_request_duration_seconds_total counter',
+        ]
+        lines += [f'tandoor_menu_http_request_duration_seconds_total{_labels(method=m, endpoint=e)} {v:.6f}' for (m, e), v in sorted(http_duration.items(), key=str)]
+        lines += [
+            '# HELP tandoor_menu_http_response_bytes_total Bytes received from the Tandoor API.',
+            '# TYPE tandoor_menu_http_response_bytes_total counter',
+        ]
+        lines += [f'tandoor_menu_http_response_bytes_total{_labels(method=m, endpoint=e)} {v}' for (m, e), v in sorted(http_bytes.items(), key=str)]
+        lines += [
+            '# HELP tandoor_menu_cache_lookups_total Cached API lookups by result.',
+            '# TYPE tandoor_menu_cache_lookups_total counter',
+        ]
+        lines += [f'tandoor_menu_cache_lookups_total{_labels(function=fn, result=r)} {v}' for (fn, r), v in sorted(cache.items(), key=str)]
+        return '\n'.join(lines) + '\n'
+
+    def write_metrics(self, path):
+        '''
+        writes Prometheus text format metrics; the file is replaced atomically so a
+        node_exporter textfile collector never reads a partial file
+        '''
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.metrics())
+        os.replace(temp, path)
+
+    def export(self, trace_file=None, metrics_file=None):
+        if trace_file:
+            self.write_trace(trace_file)
+        if metrics_file:
+            self.write_metrics(metrics_file)
+
+
+tracer = Tracer()
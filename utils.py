@@ -1,29 +1,40 @@
+import atexit
 import logging
+import queue
 import re
-import shelve
 import sys
+import threading
 from datetime import datetime, timedelta
 from functools import wraps
+from logging.handlers import QueueHandler, QueueListener
 from uuid import NAMESPACE_OID, uuid3
 
-from tqdm import tqdm
-from tzlocal import get_localzone
+from tracing import tracer
 
-_caches = None
+_backends = {}
+_cache_lock = threading.RLock()
+# keys being refreshed in the background
+_revalidating = set()
 
 
-def _get_caches():
-    global _caches
-    if _caches is not None:
-        return _caches
-    try:
-        _caches = shelve.open('caches.db', writeback=True)
-        keys_to_delete = [k for k in _caches if _caches[k]['expired'] < datetime.now()]
-        for key in keys_to_delete:
-            _caches.pop(key)
-    except Exception:
-        _caches = {}
-    return _caches
+def get_cache_backend(spec=None, logger=None):
+    '''
+    one backend per spec and process, see cache_backends.open_backend
+    '''
+    with _cache_lock:
+        if spec not in _backends:
+            from cache_backends import open_backend
+            if not _backends:
+                # written back before the interpreter starts tearing down the modules pickle needs
+                atexit.register(_close_caches)
+            _backends[spec] = open_backend(spec, logger=logger)
+        return _backends[spec]
+
+
+def _close_caches():
+    with _cache_lock:
+        for backend in _backends.values():
+            backend.close()
 
 
 class InfoFilter(logging.Filter):
@@ -31,34 +42,86 @@ class InfoFilter(logging.Filter):
         return rec.levelno in (logging.DEBUG, logging.INFO)
 
 
-class TQDM(tqdm):
+class TQDM:
+    # wraps tqdm so it is only imported when a progress bar is actually shown
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        from tqdm import tqdm
+        self.bar = tqdm(*args, **kwargs)
         self.step = 0
 
+    def update(self, n=1):
+        self.bar.update(n)
+
     def update_step(self, step=1):
         self.step += step
         self.update(step)
 
     def reset_step(self):
         self.step = 0
-        self.n = 0
+        self.bar.n = 0
 
     def last_step(self):
-        self.n = 100
+        self.bar.n = 100
+
+    def close(self):
+        self.bar.close()
 
 
 # logging methods
-def setup_logging(log='INFO'):
-    log_levels = {
-        'CRITICAL': logging.CRITICAL,
-        'ERROR': logging.ERROR,
-        'WARNING': logging.WARNING,
-        'INFO': logging.INFO,
-        'DEBUG': logging.DEBUG
-    }
+LOG_LEVELS = {
+    'CRITICAL': logging.CRITICAL,
+    'ERROR': logging.ERROR,
+    'WARNING': logging.WARNING,
+    'INFO': logging.INFO,
+    'DEBUG': logging.DEBUG
+}
+# background writers of the log: 'thread' for this process, 'process' for worker processes
+_logging = {}
+_logging_lock = threading.Lock()
+
+
+class LazyQueueHandler(QueueHandler):
+    '''
+    hands records to the background writer as they are, so a message is only formatted by the
+    handlers that write it and never in the thread that logged it
+    '''
+
+    def prepare(self, record):
+        return record
+
+
+def log_level(log):
+    level = -1
+    if isinstance(log, str):
+        level = LOG_LEVELS.get(log.upper(), -1)
+    elif isinstance(log, int):
+        if 0 <= log <= 50:
+            level = log
+
+    if level < 0:
+        print('Valid logging levels specified by either key or value:{}'.format('\n\t'.join(
+            '{}: {}'.format(key, value) for key, value in LOG_LEVELS.items()))
+        )
+        raise RuntimeError('Invalid logging level selected: {}'.format(log))
+    return level
+
+
+def setup_logging(log='INFO', file_level='DEBUG', log_file='cocktail-menu.log'):
+    '''
+    log: console logging level
+    file_level: logging level of log_file
+
+    messages are put on a queue and written by a background thread; anything below both levels
+    is dropped before a record is made
+    '''
+    level, file_level = log_level(log), log_level(file_level)
     logger = logging.getLogger('CreateMenu')
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(min(level, file_level))
+    # calling setup again replaces the handlers instead of duplicating every message
+    stop_logging()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
 
     # Set up the two formatters
     formatter_brief = logging.Formatter(fmt='[%(asctime)s] %(levelname)s: %(message)s', datefmt='%H:%M:%S')
@@ -68,40 +131,75 @@ def setup_logging(log='INFO'):
     )
 
     # Set up the file logger
-    fh = logging.FileHandler(filename='cocktail-menu.log', encoding='utf-8', mode='w')
-    fh.setLevel(logging.DEBUG)
+    fh = logging.FileHandler(filename=log_file, encoding='utf-8', mode='w')
+    fh.setLevel(file_level)
     fh.setFormatter(formatter_explicit)
-    logger.addHandler(fh)
 
     # Set up the error / warning command line logger
     ch_err = logging.StreamHandler(stream=sys.stderr)
     ch_err.setFormatter(formatter_explicit)
     ch_err.setLevel(logging.WARNING)
-    logger.addHandler(ch_err)
 
     # Set up the verbose info / debug command line logger
     ch_std = logging.StreamHandler(stream=sys.stdout)
     ch_std.setFormatter(formatter_brief)
     ch_std.addFilter(InfoFilter())
-    level = -1
-    if isinstance(log, str):
-        try:
-            level = log_levels[log.upper()]
-        except KeyError:
-            pass
-    elif isinstance(log, int):
-        if 0 <= log <= 50:
-            level = log
+    ch_std.setLevel(level)
+
+    with _logging_lock:
+        if not _logging:
+            # written out before the interpreter exits
+            atexit.register(stop_logging)
+        _logging['handlers'] = (fh, ch_err, ch_std)
+        _logging['thread'] = QueueListener(queue.SimpleQueue(), *_logging['handlers'], respect_handler_level=True)
+        _logging['thread'].start()
+    logger.addHandler(LazyQueueHandler(_logging['thread'].queue))
+    logger.loglevel = level
+    return logger
 
-    if level < 0:
-        print('Valid logging levels specified by either key or value:{}'.format('\n\t'.join(
-            '{}: {}'.format(key, value) for key, value in log_levels.items()))
-        )
-        raise RuntimeError('Invalid logging level selected: {}'.format(level))
-    else:
-        ch_std.setLevel(level)
-        logger.addHandler(ch_std)
-        logger.loglevel = level
+
+def stop_logging():
+    '''
+    writes out every queued message and closes the log handlers
+    '''
+    with _logging_lock:
+        for name in ('process', 'thread'):
+            if listener := _logging.pop(name, None):
+                listener.stop()
+        for handler in _logging.pop('handlers', ()):
+            handler.close()
+
+
+def log_queue():
+    '''
+    queue worker processes log to, written by this process's handlers; see init_worker_logging
+    '''
+    with _logging_lock:
+        if 'process' not in _logging:
+            import multiprocessing
+            _logging['process'] = QueueListener(multiprocessing.Queue(), *_logging.get('handlers', ()), respect_handler_level=True)
+            _logging['process'].start()
+        return _logging['process'].queue
+
+
+def init_worker_logging(log_queue, level=logging.DEBUG):
+    '''
+    process pool initializer: every logger of the worker sends its records to the parent through log_queue
+    level: lowest level the parent writes
+
+    Returns:
+        the CreateMenu logger of the worker
+    '''
+    logger = logging.getLogger('CreateMenu')
+    # a forked worker inherits the parent's handlers, which feed a queue nobody reads here
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.setLevel(logging.NOTSET)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
     return logger
 
 
@@ -109,6 +207,38 @@ def get_log_level(log):
     return log
 
 
+def profile_startup(argv, top=25):
+    '''
+    runs the command again with -X importtime and reports the import time of each module
+    argv: command line of the current process
+
+    Returns:
+        exit code of the profiled run
+    '''
+    import subprocess
+    timings = []
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime'] + argv, stderr=subprocess.PIPE, text=True)
+    for line in proc.stderr:
+        if not line.startswith('import time:'):
+            sys.stderr.write(line)
+            continue
+        try:
+            self_us, cumulative_us, package = line[len('import time:'):].split('|')
+            timings.append((int(cumulative_us), int(self_us), package.rstrip()))
+        except ValueError:
+            # the header line
+            continue
+    proc.wait()
+
+    # top level imports have the least indentation, their cumulative times add up to the total
+    total = sum(c for c, _, p in timings if len(p) - len(p.lstrip()) == 1)
+    print(f'\nStartup import time: {total / 1000:.1f} ms across {len(timings)} modules.', file=sys.stderr)
+    print(f'{"cumulative ms":>14} {"self ms":>9}  module', file=sys.stderr)
+    for cumulative, self_time, package in sorted(timings, reverse=True)[:top]:
+        print(f'{cumulative / 1000:>14.1f} {self_time / 1000:>9.1f}  {package.strip()}', file=sys.stderr)
+    return proc.returncode
+
+
 # utlity methods
 def str2bool(v):
     if isinstance(v, bool) or v is None:
@@ -126,6 +256,7 @@ def string_to_date(date_str):
 
     # Use re.match to check if the string matches the pattern
     if re.match(pattern, date_str):
+        from tzlocal import get_localzone
         if date_str[:1] == '-':
             return datetime.strptime(date_str[1:], '%Y-%m-%d').replace(tzinfo=get_localzone()), False
         else:
@@ -154,6 +285,7 @@ def split_offset(s):
 
 
 def format_date(string, future=False):
+    from tzlocal import get_localzone
     date, after = string_to_date(string)
     if date:
         return date, after
@@ -206,24 +338,70 @@ def display_progress(func):
     return wrapper
 
 
+def _store(caches, key, data, ttl, stale):
+    now = datetime.now()
+    entry = {'data': data, 'expired': now + timedelta(minutes=ttl), 'stale': now + timedelta(minutes=ttl + stale)}
+    caches.set(key, entry, entry['stale'])
+    return entry
+
+
+def _revalidate(func, self, args, kwargs, caches, key, ttl, stale):
+    with _cache_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+    def _refresh():
+        tracer.set_cache_state('revalidate')
+        try:
+            _store(caches, key, func(self, *args, **kwargs), ttl, stale)
+        except Exception as e:
+            if logger := getattr(self, 'logger', None):
+                logger.debug(f'Background refresh of {func.__name__} failed: {e}')
+        finally:
+            with _cache_lock:
+                _revalidating.discard(key)
+
+    # not a daemon, the interpreter waits for the refresh to be stored before it exits
+    threading.Thread(target=_refresh, name=f'revalidate-{func.__name__}').start()
+
+
 def cached(func):
     @wraps(func)
     def wrapper(self, *args, **kwargs):
-        caches = _get_caches()
+        caches = get_cache_backend(getattr(self, 'cache_backend', None), getattr(self, 'logger', None))
+        # refresh fetches the result even when it is cached, it isn't part of the cache key
+        refresh = kwargs.pop('refresh', False)
+        stale = 0
         if (ttl := kwargs.get('ttl', None)) is None:
-            try:
-                ttl = self.ttl
-            except AttributeError:
-                ttl = 240
+            if hasattr(self, 'cache_policy'):
+                ttl, stale = self.cache_policy(func.__name__, args)
+            else:
+                ttl = getattr(self, 'ttl', 240)
         if not ttl or ttl <= 0:
             return func(self, *args, **kwargs)
-        expire_after = timedelta(minutes=ttl)
-        # uuid's are consistent across runs, hash() is not
-        key = str(uuid3(NAMESPACE_OID, ''.join([str(x) for x in args]) + str(kwargs)))
-        if key not in caches or caches[key]['expired'] < datetime.now():
-            caches[key] = {'data': func(self, *args, **kwargs), 'expired': datetime.now() + expire_after}
-            if hasattr(caches, 'sync'):
-                caches.sync()
-
-        return caches[key]['data']
+        # uuid's are consistent across runs, hash() is not; the function name keeps calls with equal arguments apart
+        key = str(uuid3(NAMESPACE_OID, func.__name__ + ''.join([str(x) for x in args]) + str(kwargs)))
+        # a shared cache holds entries of several servers and users
+        if namespace := getattr(self, 'cache_namespace', None):
+            key = f'{namespace}:{key}'
+        with tracer.span('cache', category='cache', function=func.__name__) as span:
+            entry = None if refresh else caches.get(key)
+            now = datetime.now()
+            if entry is not None and entry['expired'] >= now:
+                span.set(result='hit')
+            elif entry is not None and stale and entry.get('stale', entry['expired']) >= now:
+                # serve the expired entry now, the next run gets the refreshed one
+                span.set(result='stale')
+                _revalidate(func, self, args, kwargs, caches, key, ttl, stale)
+            else:
+                span.set(result='refresh' if refresh else 'miss')
+                previous = tracer.cache_state()
+                tracer.set_cache_state('miss')
+                try:
+                    entry = _store(caches, key, func(self, *args, **kwargs), ttl, stale)
+                finally:
+                    tracer.set_cache_state(previous)
+
+        return entry['data']
     return wrapper